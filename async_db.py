@@ -0,0 +1,189 @@
+import os
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from database import db
+from writer import WriteQueue
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDatabase:
+    """Runs the blocking ``Database`` queries on a bounded thread pool.
+
+    Handlers ``await`` these methods instead of touching sqlite3 directly,
+    so a slow query or fsync never stalls the event loop. Writes go through
+    a single ``WriteQueue`` that group-commits them.
+
+    ``reference_version`` is bumped after every committed change to the
+    content or payment_settings tables, ``catalog_version`` after every
+    committed change to a product row (including stock decrements at
+    checkout). Caches compare against them.
+    """
+
+    def __init__(self, database, max_workers=4, write_batch_ms=5, write_batch_max=256):
+        self.database = database
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db')
+        self.writer = WriteQueue(database, batch_window_ms=write_batch_ms, max_batch=write_batch_max)
+        self.reference_version = 0
+        self.catalog_version = 0
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def write(self, func, *args, **kwargs):
+        return await self.writer.submit(func, *args, **kwargs)
+
+    def shutdown(self):
+        self.writer.stop()
+        self._executor.shutdown(wait=True)
+        self.database.close()
+
+    # PRODUCTS
+    async def get_active_products_page(self, after_id=None, before_id=None, limit=10):
+        return await self.run(self.database.get_active_products_page, after_id, before_id, limit)
+
+    async def get_products_page(self, after_id=None, before_id=None, limit=10):
+        return await self.run(self.database.get_products_page, after_id, before_id, limit)
+
+    async def get_product_detail(self, product_id, user_id=None):
+        return await self.run(self.database.get_product_detail, product_id, user_id)
+
+    async def get_product_name_price(self, product_id):
+        return await self.run(self.database.get_product_name_price, product_id)
+
+    async def get_product_for_edit(self, product_id):
+        return await self.run(self.database.get_product_for_edit, product_id)
+
+    async def add_product(self, **product_data):
+        result = await self.write(self.database.add_product, **product_data)
+        self.catalog_version += 1
+        return result
+
+    async def delete_product(self, product_id):
+        result = await self.write(self.database.delete_product, product_id)
+        self.catalog_version += 1
+        return result
+
+    async def update_product_field(self, product_id, field, value):
+        result = await self.write(self.database.update_product_field, product_id, field, value)
+        self.catalog_version += 1
+        return result
+
+    async def toggle_product_active(self, product_id):
+        result = await self.write(self.database.toggle_product_active, product_id)
+        self.catalog_version += 1
+        return result
+
+    # CART
+    async def get_cart_lines(self, user_id):
+        return await self.run(self.database.get_cart_lines, user_id)
+
+    async def get_cart_products(self, product_ids):
+        return await self.run(self.database.get_cart_products, product_ids)
+
+    async def replace_carts(self, carts):
+        return await self.write(self.database.replace_carts, carts)
+
+    async def delete_idle_carts(self, max_idle_days, limit=200):
+        return await self.write(self.database.delete_idle_carts, max_idle_days, limit)
+
+    async def clear_cart(self, user_id):
+        return await self.write(self.database.clear_cart, user_id)
+
+    # STOCK HOLDS
+    async def hold_stock(self, user_id, product_id, quantity):
+        return await self.write(self.database.hold_stock, user_id, product_id, quantity)
+
+    async def hold_cart_line(self, user_id, product_id, quantity):
+        return await self.write(self.database.hold_cart_line, user_id, product_id, quantity)
+
+    async def hold_cart_lines(self, user_id, quantities):
+        return await self.write(self.database.hold_cart_lines, user_id, quantities)
+
+    async def release_holds(self, user_id, product_ids):
+        return await self.write(self.database.release_holds, user_id, product_ids)
+
+    async def refresh_holds(self, user_id):
+        return await self.write(self.database.refresh_holds, user_id)
+
+    async def release_expired_holds(self, limit=500):
+        return await self.write(self.database.release_expired_holds, limit)
+
+    async def archive_orders(self, max_age_days, limit=200):
+        return await self.write(self.database.archive_orders, max_age_days, limit)
+
+    async def incremental_vacuum(self, pages):
+        return await self.write(self.database.incremental_vacuum, pages)
+
+    # CONTENT AND PAYMENT SETTINGS
+    async def get_reference_data(self):
+        return await self.run(self.database.get_reference_data)
+
+    async def update_content(self, key, value):
+        result = await self.write(self.database.update_content, key, value)
+        self.reference_version += 1
+        return result
+
+    async def upsert_payment_method(self, currency, address, blockchain):
+        result = await self.write(self.database.upsert_payment_method, currency, address, blockchain)
+        self.reference_version += 1
+        return result
+
+    async def delete_payment_method(self, currency):
+        result = await self.write(self.database.delete_payment_method, currency)
+        self.reference_version += 1
+        return result
+
+    # DISCOUNT CODES
+    async def get_discount_code(self, code):
+        return await self.run(self.database.get_discount_code, code)
+
+    # ORDERS
+    async def create_order(self, **order_data):
+        result = await self.write(self.database.create_order, **order_data)
+        if result['status'] == 'placed':
+            self.catalog_version += 1
+        return result
+
+    async def get_order_summary(self, order_id):
+        return await self.run(self.database.get_order_summary, order_id)
+
+    async def complete_order(self, order_id):
+        return await self.write(self.database.complete_order, order_id)
+
+    async def reject_order(self, order_id):
+        result = await self.write(self.database.reject_order, order_id)
+        if result is not None:
+            self.catalog_version += 1
+        return result
+
+    async def expire_pending_orders(self, max_age_hours, limit=200):
+        result = await self.write(self.database.expire_pending_orders, max_age_hours, limit)
+        if result:
+            self.catalog_version += 1
+        return result
+
+    # OUTBOX
+    async def get_due_notifications(self, limit=50):
+        return await self.run(self.database.get_due_notifications, limit)
+
+    async def mark_notifications(self, sent_ids, failures):
+        return await self.write(self.database.mark_notifications, sent_ids, failures)
+
+    # STATISTICS
+    async def get_statistics(self):
+        return await self.run(self.database.get_statistics)
+
+
+# Create global async database instance
+adb = AsyncDatabase(
+    db,
+    max_workers=int(os.getenv('DB_WORKERS', 4)),
+    write_batch_ms=float(os.getenv('DB_WRITE_BATCH_MS', 5)),
+    write_batch_max=int(os.getenv('DB_WRITE_BATCH_MAX', 256))
+)
@@ -0,0 +1,154 @@
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+from datetime import datetime
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+
+class BackupManager:
+    """Online snapshots of the live database through the SQLite backup API.
+
+    The copy runs in a worker thread, ``pages_per_step`` pages at a time with
+    a ``step_sleep`` pause after each step. The source connection holds one
+    read transaction for the whole copy: under WAL that doesn't block the
+    writer, and the snapshot stays consistent instead of restarting every
+    time the bot writes. A snapshot only gets its final name once
+    ``PRAGMA integrity_check`` passes, and only the newest ``keep`` are kept.
+    """
+
+    def __init__(self, database, directory='backups', keep=7, pages_per_step=256, step_sleep=0.05):
+        self.database = database
+        self.directory = directory
+        self.keep = keep
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self._prefix = os.path.splitext(os.path.basename(database.db_path))[0] + '-'
+        self._lock = asyncio.Lock()
+        # (pages copied, total pages) while a backup runs
+        self.progress = None
+        # Outcome of the last backup: path, size, finished_at and error
+        self.last_result = None
+
+    @property
+    def running(self):
+        return self._lock.locked()
+
+    async def run(self):
+        """Takes a snapshot and returns its path, or None if it failed or one is already running."""
+        if self._lock.locked():
+            return None
+
+        async with self._lock:
+            self.progress = (0, 0)
+            started = time.monotonic()
+            try:
+                path = await asyncio.to_thread(self._backup)
+            except Exception as e:
+                logger.exception("Database backup failed")
+                self.last_result = {'path': None, 'size': 0, 'finished_at': datetime.now(), 'error': str(e)}
+                return None
+            finally:
+                self.progress = None
+
+            size = os.path.getsize(path)
+            self.last_result = {'path': path, 'size': size, 'finished_at': datetime.now(), 'error': None}
+            logger.info("Backed up database to %s (%d bytes) in %.1fs", path, size, time.monotonic() - started)
+            return path
+
+    def snapshots(self):
+        """Paths of the kept snapshots, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(self._prefix) and name.endswith('.db')
+        )
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _on_step(self, status, remaining, total):
+        self.progress = (total - remaining, total)
+        time.sleep(self.step_sleep)
+
+    def _backup(self):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = f"{self._prefix}{datetime.now():%Y%m%d-%H%M%S-%f}"
+        path = os.path.join(self.directory, f"{stamp}.db")
+        counter = 0
+        while os.path.exists(path):
+            counter += 1
+            path = os.path.join(self.directory, f"{stamp}-{counter}.db")
+        partial = path + '.partial'
+
+        try:
+            self._copy(partial)
+            self._publish(partial, path)
+        finally:
+            # Gone after a successful publish; otherwise never left behind
+            if os.path.exists(partial):
+                os.remove(partial)
+        self._rotate()
+        return path
+
+    def _copy(self, partial):
+        source = self.database._create_connection()
+        source.isolation_level = None
+        target = sqlite3.connect(partial)
+        try:
+            # Pin one snapshot of the source for every step of the copy
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            source.backup(target, pages=self.pages_per_step, progress=self._on_step)
+            source.execute('COMMIT')
+
+            # The copied header says WAL; a standalone snapshot is better off without
+            target.execute('PRAGMA journal_mode = DELETE')
+            result = target.execute('PRAGMA integrity_check').fetchall()
+        finally:
+            target.close()
+            source.close()
+
+        if result != [('ok',)]:
+            raise RuntimeError(f"Snapshot failed integrity check: {result[0][0]}")
+
+    def _publish(self, partial, path):
+        """Gives the verified snapshot its final name without replacing an existing file."""
+        try:
+            # A hard link never replaces an existing snapshot, unlike a rename
+            os.link(partial, path)
+        except FileExistsError:
+            raise
+        except OSError:
+            # No hard links on this filesystem: claim the name first, then
+            # rename over the empty file that is ours
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            try:
+                os.replace(partial, path)
+            except OSError:
+                os.remove(path)
+                raise
+
+    def _rotate(self):
+        snapshots = self.snapshots()
+        for path in snapshots[:max(len(snapshots) - self.keep, 0)]:
+            os.remove(path)
+            logger.info("Removed old backup %s", path)
+
+        # Left behind by a backup that was interrupted
+        for name in os.listdir(self.directory):
+            if name.startswith(self._prefix) and name.endswith('.partial'):
+                os.remove(os.path.join(self.directory, name))
+
+
+# Create global backup manager instance
+backup_manager = BackupManager(
+    db,
+    directory=os.getenv('BACKUP_DIR', 'backups'),
+    keep=int(os.getenv('BACKUP_KEEP', 7)),
+    pages_per_step=int(os.getenv('BACKUP_PAGES_PER_STEP', 256)),
+    step_sleep=float(os.getenv('BACKUP_STEP_SLEEP', 0.05))
+)
@@ -1,10 +1,14 @@
 import os
+import signal
+import asyncio
 import logging
+import functools
 from dotenv import load_dotenv
 from telegram import (
     Update, 
     InlineKeyboardButton, 
     InlineKeyboardMarkup,
+    InputMediaPhoto,
     ReplyKeyboardRemove
 )
 from telegram.ext import (
@@ -16,7 +20,7 @@ from telegram.ext import (
     ContextTypes,
     ConversationHandler
 )
-import sqlite3
+from telegram.error import BadRequest
 from datetime import datetime
 import uuid
 
@@ -31,7 +35,17 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Database instance
-from database import db
+from async_db import adb
+from cache import reference_cache, catalog_cache
+from router import CallbackRouter
+from callback_codec import CallbackCodec
+from webhook import WebhookServer
+from update_processor import PerUserUpdateProcessor
+from sender import send_queue, PRIORITY_HIGH
+from outbox import outbox
+from cart_store import cart_store
+from backup import backup_manager
+import jobs
 
 # States for conversations
 (
@@ -53,14 +67,79 @@ from database import db
     PAYMENT_SOURCE_ADDRESS,
     
     # Discount code input
-    DISCOUNT_CODE_INPUT
-) = range(23)
+    DISCOUNT_CODE_INPUT,
+    
+    # Admin product editing
+    PRODUCT_EDIT_VALUE
+) = range(21)
+
+# Product fields the admin can edit, with the prompt shown for each
+PRODUCT_EDIT_FIELDS = {
+    'name': "Enter the new product name:",
+    'price': "Enter the new price (example: 25.00):",
+    'description': "Enter the new description:",
+    'quantity': "Enter the new quantity (example: 5):",
+    'coordinates': "Enter new coordinates in format: 59.4370, 24.7536\nOr send 'skip' to clear them.",
+    'image1': "Send the new first product image:",
+    'image2': "Send the new second product image:"
+}
+
+# Rows per page in the catalog and in admin product management
+PRODUCTS_PAGE_SIZE = int(os.getenv('PRODUCTS_PAGE_SIZE', 10))
+
+# Seconds between outbox dispatch rounds, new orders also trigger one right away
+OUTBOX_INTERVAL = float(os.getenv('OUTBOX_INTERVAL', 5))
+
+# Seconds between write-backs of changed carts to the database
+CART_FLUSH_INTERVAL = float(os.getenv('CART_FLUSH_INTERVAL', 5))
+
+# Seconds between sweeps of expired stock holds
+STOCK_HOLD_SWEEP_INTERVAL = float(os.getenv('STOCK_HOLD_SWEEP_INTERVAL', 60))
+
+# Seconds between sweeps for unpaid orders past their deadline
+ORDER_EXPIRY_INTERVAL = float(os.getenv('ORDER_EXPIRY_INTERVAL', 300))
+
+# Seconds between abandoned cart cleanups
+CART_CLEANUP_INTERVAL = float(os.getenv('CART_CLEANUP_INTERVAL', 3600))
+
+# Seconds between order archive runs
+ORDER_ARCHIVE_INTERVAL = float(os.getenv('ORDER_ARCHIVE_INTERVAL', 3600))
+
+# Seconds between scheduled database backups
+BACKUP_INTERVAL = float(os.getenv('BACKUP_INTERVAL', 86400))
+
+# Telegram accepts 2-10 photos per media group
+MEDIA_GROUP_SIZE = 10
+
+# Display names for payment currencies
+CURRENCY_LABELS = {
+    'btc': '₿ Bitcoin',
+    'eth': 'Ξ Ethereum',
+    'sol': '◎ Solana',
+    'ltc': '💎 Litecoin',
+    'usdt': '💵 USDT'
+}
+
+CURRENCY_NAMES = {
+    'btc': 'Bitcoin',
+    'eth': 'Ethereum',
+    'sol': 'Solana',
+    'ltc': 'Litecoin',
+    'usdt': 'USDT'
+}
 
 class StoreBot:
     def __init__(self):
         self.token = os.getenv('BOT_TOKEN')
         self.admin_id = int(os.getenv('ADMIN_ID'))
         self.exchange_rate = float(os.getenv('EXCHANGE_RATE', 1.16))
+        self.router = self.build_router()
+        
+        # Notifications written to the outbox together with the order change
+        outbox.register('payment_pending', self.notify_admin_of_payment)
+        outbox.register('order_completed', self.send_order_delivery, parts=True)
+        outbox.register('order_rejected', self.send_rejection_notice)
+        outbox.register('order_expired', self.send_expiry_notice)
         
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
@@ -70,7 +149,7 @@ class StoreBot:
             await self.show_admin_panel(update, context)
             return
             
-        welcome_message = self.get_content('welcome_message')
+        welcome_message = await self.get_content('welcome_message')
         
         keyboard = [
             [
@@ -97,129 +176,103 @@ class StoreBot:
         else:
             await update.callback_query.edit_message_text(welcome_message, reply_markup=reply_markup)
     
+    def build_router(self):
+        # Encoded callback data is checksummed with a key derived from the bot token
+        codec = CallbackCodec(secret=(self.token or '').encode())
+        router = CallbackRouter(is_admin=lambda user_id: user_id == self.admin_id, codec=codec)
+        
+        # Client routes
+        router.exact("browse_products", self.show_products)
+        router.exact("view_cart", self.show_cart)
+        router.exact("about", self.show_about)
+        router.exact("contact", self.show_contact)
+        router.exact("website", self.show_website)
+        router.exact("rules", self.show_rules)
+        router.exact("faq", self.show_faq)
+        router.exact("main_menu", self.start)
+        router.exact("back_to_products", self.show_products)
+        router.exact("continue_shopping", self.show_products)
+        router.exact("clear_cart", self.clear_cart, answers=True)
+        router.exact("checkout_all", self.start_checkout)
+        router.exact("no_discount", self.show_payment_methods)
+        router.exact("continue_to_payment", self.ask_discount_code)
+        router.exact("payment_made", self.ask_payment_source_address)
+        router.exact("back_to_payment_methods", self.show_payment_methods)
+        router.prefix("product_", self.show_product_detail, int)
+        router.prefix("add_to_cart_", self.add_to_cart, int, answers=True)
+        router.prefix("buy_now_", self.buy_now, int)
+        router.prefix("payment_", self.show_payment_details, str)
+        router.prefix("products_next_", lambda update, context, product_id: self.show_products(update, context, after_id=product_id), int)
+        router.prefix("products_prev_", lambda update, context, product_id: self.show_products(update, context, before_id=product_id), int)
+        
+        # Admin routes
+        router.exact("admin_panel", self.show_admin_panel, admin_only=True)
+        router.exact("product_management", self.show_product_management, admin_only=True)
+        router.exact("content_management", self.show_content_management, admin_only=True)
+        router.exact("payment_settings", self.show_payment_settings, admin_only=True)
+        router.exact("discount_codes", self.show_discount_management, admin_only=True)
+        router.exact("statistics", self.show_statistics, admin_only=True)
+        router.exact("backups", self.show_backups, admin_only=True)
+        router.exact("start_backup", self.start_backup, admin_only=True, answers=True)
+        router.exact("add_new_product", self.start_add_product, admin_only=True)
+        router.exact("add_new_crypto", self.start_add_payment_method, admin_only=True)
+        router.prefix("admin_products_next_", lambda update, context, product_id: self.show_product_management(update, context, after_id=product_id), int, admin_only=True)
+        router.prefix("admin_products_prev_", lambda update, context, product_id: self.show_product_management(update, context, before_id=product_id), int, admin_only=True)
+        router.prefix("edit_product_", self.show_product_edit, int, admin_only=True)
+        for field in PRODUCT_EDIT_FIELDS:
+            router.prefix(f"edit_{field}_", functools.partial(self.start_edit_product_field, field=field), int, admin_only=True)
+        router.prefix("toggle_active_", self.toggle_product_active, int, admin_only=True, answers=True)
+        router.prefix("delete_product_", self.confirm_delete_product, int, admin_only=True)
+        router.prefix("confirm_delete_", self.delete_product, int, admin_only=True, answers=True)
+        router.prefix("cancel_delete_", self.show_product_edit, int, admin_only=True)
+        router.prefix("edit_content_", self.start_edit_content, str, admin_only=True)
+        router.prefix("edit_payment_", self.start_edit_payment, str, admin_only=True)
+        router.prefix("remove_payment_", self.remove_payment_method, str, admin_only=True)
+        
+        # Admin payment confirmation routes
+        router.prefix("admin_confirm_", self.ask_admin_confirmation, str, admin_only=True)
+        router.prefix("admin_confirm_yes_", self.confirm_payment, str, admin_only=True)
+        router.prefix("admin_confirm_no_", self.cancel_confirmation, str, admin_only=True)
+        router.prefix("admin_reject_", self.reject_payment, str, admin_only=True)
+        
+        return router
+    
     async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        query = update.callback_query
-        await query.answer()
-        
-        data = query.data
-        
-        # Client handlers
-        if data == "browse_products":
-            await self.show_products(update, context)
-        elif data == "view_cart":
-            await self.show_cart(update, context)
-        elif data == "about":
-            await self.show_about(update, context)
-        elif data == "contact":
-            await self.show_contact(update, context)
-        elif data == "website":
-            await self.show_website(update, context)
-        elif data == "rules":
-            await self.show_rules(update, context)
-        elif data == "faq":
-            await self.show_faq(update, context)
-        elif data == "main_menu":
-            await self.start(update, context)
-        elif data.startswith("product_"):
-            product_id = int(data.split("_")[1])
-            await self.show_product_detail(update, context, product_id)
-        elif data.startswith("add_to_cart_"):
-            product_id = int(data.split("_")[3])
-            await self.add_to_cart(update, context, product_id)
-        elif data == "back_to_products":
-            await self.show_products(update, context)
-        elif data == "continue_shopping":
-            await self.show_products(update, context)
-        elif data == "clear_cart":
-            await self.clear_cart(update, context)
-        elif data == "checkout_all":
-            await self.start_checkout(update, context)
-        elif data.startswith("buy_now_"):
-            product_id = int(data.split("_")[2])
-            await self.buy_now(update, context, product_id)
-        elif data == "no_discount":
-            await self.show_payment_methods(update, context)
-        elif data == "continue_to_payment":
-            await self.ask_discount_code(update, context)
-        elif data.startswith("payment_"):
-            currency = data.split("_")[1]
-            await self.show_payment_details(update, context, currency)
-        elif data == "payment_made":
-            await self.ask_payment_source_address(update, context)
-        elif data == "back_to_payment_methods":
-            await self.show_payment_methods(update, context)
-        
-        # Admin handlers
-        elif data == "admin_panel":
-            await self.show_admin_panel(update, context)
-        elif data == "product_management":
-            await self.show_product_management(update, context)
-        elif data == "content_management":
-            await self.show_content_management(update, context)
-        elif data == "payment_settings":
-            await self.show_payment_settings(update, context)
-        elif data == "discount_codes":
-            await self.show_discount_management(update, context)
-        elif data == "statistics":
-            await self.show_statistics(update, context)
-        elif data == "add_new_product":
-            await self.start_add_product(update, context)
-        elif data.startswith("edit_product_"):
-            product_id = int(data.split("_")[2])
-            await self.show_product_edit(update, context, product_id)
-        elif data.startswith("delete_product_"):
-            product_id = int(data.split("_")[2])
-            await self.confirm_delete_product(update, context, product_id)
-        elif data.startswith("confirm_delete_"):
-            product_id = int(data.split("_")[2])
-            await self.delete_product(update, context, product_id)
-        elif data.startswith("cancel_delete_"):
-            product_id = int(data.split("_")[2])
-            await self.show_product_edit(update, context, product_id)
-        elif data.startswith("edit_content_"):
-            content_key = data.split("_")[2]
-            await self.start_edit_content(update, context, content_key)
-        elif data.startswith("edit_payment_"):
-            currency = data.split("_")[2]
-            await self.start_edit_payment(update, context, currency)
-        elif data.startswith("remove_payment_"):
-            currency = data.split("_")[2]
-            await self.remove_payment_method(update, context, currency)
-        elif data == "add_new_crypto":
-            await self.start_add_payment_method(update, context)
-        elif data == "add_client_specific_code":
-            await self.start_add_client_specific_code(update, context)
-        elif data == "add_general_discount":
-            await self.start_add_general_discount(update, context)
-        elif data == "view_all_codes":
-            await self.show_all_discount_codes(update, context)
-        
-        # Admin payment confirmation handlers
-        elif data.startswith("admin_confirm_"):
-            order_id = data.split("_")[2]
-            await self.ask_admin_confirmation(update, context, order_id)
-        elif data.startswith("admin_confirm_yes_"):
-            order_id = data.split("_")[3]
-            await self.confirm_payment(update, context, order_id)
-        elif data.startswith("admin_confirm_no_"):
-            order_id = data.split("_")[3]
-            await self.cancel_confirmation(update, context, order_id)
-        elif data.startswith("admin_reject_"):
-            order_id = data.split("_")[2]
-            await self.reject_payment(update, context, order_id)
+        return await self.router.dispatch(update, context)
+    
+    def page_navigation(self, rows, has_more, after_id, before_id, prefix):
+        """Previous/next buttons for a keyset page, or None when there is only one page."""
+        if not rows:
+            return None
+        
+        # has_more only describes the direction we paged in; the other side
+        # has rows whenever we arrived from there
+        has_previous = has_more if before_id is not None else after_id is not None
+        has_next = has_more if before_id is None else True
+        
+        buttons = []
+        if has_previous:
+            buttons.append(InlineKeyboardButton("⬅️ Previous", callback_data=self.router.data(f"{prefix}_prev_", rows[0][0])))
+        if has_next:
+            buttons.append(InlineKeyboardButton("Next ➡️", callback_data=self.router.data(f"{prefix}_next_", rows[-1][0])))
+        return buttons or None
     
     # CLIENT FUNCTIONS
-    async def show_products(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, name, price, quantity FROM products 
-            WHERE active = TRUE AND quantity > 0
-            ORDER BY name
-        ''')
-        products = cursor.fetchall()
-        conn.close()
+    async def show_products(self, update: Update, context: ContextTypes.DEFAULT_TYPE, after_id: int = None, before_id: int = None):
+        text, reply_markup = await catalog_cache.get_page(
+            (after_id, before_id),
+            functools.partial(self.render_products_page, after_id, before_id)
+        )
+        
+        query = update.callback_query
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    
+    async def render_products_page(self, after_id: int = None, before_id: int = None):
+        products, has_more = await adb.get_active_products_page(after_id, before_id, PRODUCTS_PAGE_SIZE)
+        
+        # The cursor product is gone or sold out, start over from the first page
+        if not products and (after_id is not None or before_id is not None):
+            return await self.render_products_page()
         
         if not products:
             text = "🛍️ Our Products:\n\nNo products available at the moment."
@@ -230,28 +283,21 @@ class StoreBot:
         for product in products:
             product_id, name, price, quantity = product
             button_text = f"{name} - {price}€" if quantity == 1 else f"{name} - {price}€ ({quantity} pcs)"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"product_{product_id}")])
+            keyboard.append([InlineKeyboardButton(button_text, callback_data=self.router.data("product_", product_id))])
+        
+        navigation = self.page_navigation(products, has_more, after_id, before_id, "products")
+        if navigation:
+            keyboard.append(navigation)
         
         keyboard.append([
             InlineKeyboardButton("🛒 View Cart", callback_data="view_cart"),
             InlineKeyboardButton("🔙 Back", callback_data="main_menu")
         ])
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        query = update.callback_query
-        await query.edit_message_text(text, reply_markup=reply_markup)
+        return text, InlineKeyboardMarkup(keyboard)
     
     async def show_product_detail(self, update: Update, context: ContextTypes.DEFAULT_TYPE, product_id: int):
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT name, description, price, quantity FROM products 
-            WHERE id = ? AND active = TRUE
-        ''', (product_id,))
-        product = cursor.fetchone()
-        conn.close()
+        product = await adb.get_product_detail(product_id, update.callback_query.from_user.id)
         
         if not product:
             await update.callback_query.edit_message_text("Product not found!")
@@ -267,8 +313,8 @@ class StoreBot:
         
         keyboard = [
             [
-                InlineKeyboardButton("💰 Buy Now", callback_data=f"buy_now_{product_id}"),
-                InlineKeyboardButton("🛒 Add to Cart", callback_data=f"add_to_cart_{product_id}")
+                InlineKeyboardButton("💰 Buy Now", callback_data=self.router.data("buy_now_", product_id)),
+                InlineKeyboardButton("🛒 Add to Cart", callback_data=self.router.data("add_to_cart_", product_id))
             ],
             [
                 InlineKeyboardButton("🔙 Back to Products", callback_data="browse_products"),
@@ -284,57 +330,21 @@ class StoreBot:
     async def add_to_cart(self, update: Update, context: ContextTypes.DEFAULT_TYPE, product_id: int):
         user_id = update.callback_query.from_user.id
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        # Check if product exists and has quantity
-        cursor.execute('SELECT name, price, quantity FROM products WHERE id = ? AND active = TRUE', (product_id,))
-        product = cursor.fetchone()
+        status, name, quantity = await cart_store.add(user_id, product_id)
         
-        if not product:
+        if status == 'not_found':
             await update.callback_query.answer("Product not available!", show_alert=True)
             return
+        if status == 'insufficient':
+            await update.callback_query.answer("Not enough quantity available!", show_alert=True)
+            return
         
-        name, price, available_quantity = product
-        
-        # Check if item already in cart
-        cursor.execute('SELECT quantity FROM cart WHERE user_id = ? AND product_id = ?', (user_id, product_id))
-        existing_item = cursor.fetchone()
-        
-        if existing_item:
-            current_quantity = existing_item[0]
-            if current_quantity + 1 > available_quantity:
-                await update.callback_query.answer("Not enough quantity available!", show_alert=True)
-                return
-            cursor.execute(
-                'UPDATE cart SET quantity = quantity + 1 WHERE user_id = ? AND product_id = ?',
-                (user_id, product_id)
-            )
-        else:
-            cursor.execute(
-                'INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, 1)',
-                (user_id, product_id)
-            )
-        
-        conn.commit()
-        conn.close()
-        
-        await update.callback_query.answer(f"Added {name} to cart!")
+        await update.callback_query.answer(f"Added {name} to cart! ({quantity} in cart)")
     
     async def show_cart(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.callback_query.from_user.id
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT c.product_id, c.quantity, p.name, p.price 
-            FROM cart c 
-            JOIN products p ON c.product_id = p.id 
-            WHERE c.user_id = ? AND p.active = TRUE
-        ''', (user_id,))
-        cart_items = cursor.fetchall()
-        conn.close()
+        cart_items = await cart_store.get_items(user_id)
         
         if not cart_items:
             text = "🛒 Your cart is empty!"
@@ -378,16 +388,21 @@ class StoreBot:
     async def clear_cart(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.callback_query.from_user.id
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM cart WHERE user_id = ?', (user_id,))
-        conn.commit()
-        conn.close()
+        await cart_store.clear(user_id)
         
         await update.callback_query.answer("Cart cleared!")
         await self.show_cart(update, context)
     
     async def buy_now(self, update: Update, context: ContextTypes.DEFAULT_TYPE, product_id: int):
+        # Reserve the piece right away so the customer gets a definite answer
+        status, name = await adb.hold_stock(update.callback_query.from_user.id, product_id, 1)
+        if status == 'not_found':
+            await update.callback_query.edit_message_text("Product not found!")
+            return
+        if status == 'insufficient':
+            await update.callback_query.edit_message_text(f"❌ {name} is sold out or reserved by other customers.")
+            return
+        
         context.user_data['current_order'] = {
             'type': 'single',
             'product_id': product_id,
@@ -398,14 +413,10 @@ class StoreBot:
     async def start_checkout(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.callback_query.from_user.id
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
         if 'current_order' in context.user_data and context.user_data['current_order']['type'] == 'single':
             # Single product purchase
             product_id = context.user_data['current_order']['product_id']
-            cursor.execute('SELECT name, price FROM products WHERE id = ?', (product_id,))
-            product = cursor.fetchone()
+            product = await adb.get_product_name_price(product_id)
             
             if product:
                 name, price = product
@@ -413,14 +424,9 @@ class StoreBot:
                 context.user_data['checkout_total'] = total
                 context.user_data['checkout_items'] = [{'product_id': product_id, 'name': name, 'price': price, 'quantity': 1}]
         else:
-            # Cart checkout
-            cursor.execute('''
-                SELECT c.product_id, c.quantity, p.name, p.price 
-                FROM cart c 
-                JOIN products p ON c.product_id = p.id 
-                WHERE c.user_id = ?
-            ''', (user_id,))
-            cart_items = cursor.fetchall()
+            # Cart checkout, the cart's holds last for the whole payment flow
+            await adb.refresh_holds(user_id)
+            cart_items = await cart_store.get_items(user_id, active_only=False)
             
             total = 0
             checkout_items = []
@@ -438,8 +444,6 @@ class StoreBot:
             context.user_data['checkout_total'] = total
             context.user_data['checkout_items'] = checkout_items
         
-        conn.close()
-        
         await self.ask_discount_code(update, context)
     
     async def ask_discount_code(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -468,16 +472,8 @@ Do you have a discount code? Enter it below or press 'No Code' to continue:"""
         discount_code = update.message.text.upper()
         user_id = update.effective_user.id
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
         # Check if discount code is valid
-        cursor.execute('''
-            SELECT discount_percentage, expiry_date, max_uses, used_count, is_general, client_id, client_username, active
-            FROM discount_codes 
-            WHERE code = ? AND active = TRUE
-        ''', (discount_code,))
-        code_data = cursor.fetchone()
+        code_data = await adb.get_discount_code(discount_code)
         
         if not code_data:
             await update.message.reply_text("❌ Invalid discount code. Please try again or press 'No Code':")
@@ -529,22 +525,14 @@ Do you have a discount code? Enter it below or press 'No Code' to continue:"""
         return ConversationHandler.END
     
     async def show_payment_methods(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT currency_code, address, blockchain FROM payment_settings')
-        payment_methods = cursor.fetchall()
-        conn.close()
+        payment_methods = await reference_cache.get_payment_methods()
         
         total = context.user_data.get('checkout_total', 0)
         usd_total = total * self.exchange_rate
         
         if 'current_order' in context.user_data and context.user_data['current_order']['type'] == 'single':
             product_id = context.user_data['current_order']['product_id']
-            conn = db.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT name, price FROM products WHERE id = ?', (product_id,))
-            product = cursor.fetchone()
-            conn.close()
+            product = await adb.get_product_name_price(product_id)
             product_text = f"🛍️ {product[0]}\n💰 Price: {product[1]}€"
         else:
             product_text = "🛍️ Multiple products from cart"
@@ -555,17 +543,9 @@ Do you have a discount code? Enter it below or press 'No Code' to continue:"""
 💰 Total: {total:.2f}€ (${usd_total:.2f})"""
         
         keyboard = []
-        for method in payment_methods:
-            currency_code, address, blockchain = method
-            currency_name = {
-                'btc': '₿ Bitcoin',
-                'eth': 'Ξ Ethereum', 
-                'sol': '◎ Solana',
-                'ltc': '💎 Litecoin',
-                'usdt': '💵 USDT'
-            }.get(currency_code, currency_code.upper())
-            
-            keyboard.append([InlineKeyboardButton(currency_name, callback_data=f"payment_{currency_code}")])
+        for currency_code, address, blockchain in payment_methods:
+            currency_name = CURRENCY_LABELS.get(currency_code, currency_code.upper())
+            keyboard.append([InlineKeyboardButton(currency_name, callback_data=self.router.data("payment_", currency_code))])
         
         keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="view_cart")])
         
@@ -575,11 +555,7 @@ Do you have a discount code? Enter it below or press 'No Code' to continue:"""
         await query.edit_message_text(text, reply_markup=reply_markup)
     
     async def show_payment_details(self, update: Update, context: ContextTypes.DEFAULT_TYPE, currency: str):
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT address, blockchain FROM payment_settings WHERE currency_code = ?', (currency,))
-        payment_method = cursor.fetchone()
-        conn.close()
+        payment_method = await reference_cache.get_payment_method(currency)
         
         if not payment_method:
             await update.callback_query.edit_message_text("Payment method not found!")
@@ -589,13 +565,7 @@ Do you have a discount code? Enter it below or press 'No Code' to continue:"""
         total = context.user_data.get('checkout_total', 0)
         usd_total = total * self.exchange_rate
         
-        currency_name = {
-            'btc': 'Bitcoin',
-            'eth': 'Ethereum',
-            'sol': 'Solana', 
-            'ltc': 'Litecoin',
-            'usdt': 'USDT'
-        }.get(currency, currency.upper())
+        currency_name = CURRENCY_NAMES.get(currency, currency.upper())
         
         text = f"""💳 **PAYMENT DETAILS**
 
@@ -644,51 +614,29 @@ Example: `1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa`"""
         user = update.effective_user
         order_id = str(uuid.uuid4())[:8].upper()
         
-        # Create order record
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
         checkout_items = context.user_data.get('checkout_items', [])
         total = context.user_data.get('checkout_total', 0)
         currency = context.user_data.get('payment_currency')
         discount_code = context.user_data.get('discount_code')
         
-        for item in checkout_items:
-            cursor.execute('''
-                INSERT INTO orders 
-                (user_id, user_name, product_id, product_name, quantity, total_price, order_id, payment_currency, payment_source_address, discount_code)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                user.id,
-                user.username or user.first_name,
-                item['product_id'],
-                item['name'],
-                item['quantity'],
-                total,
-                order_id,
-                currency,
-                payment_source,
-                discount_code
-            ))
-            
-            # Update product quantity
-            cursor.execute('''
-                UPDATE products SET quantity = quantity - ? WHERE id = ?
-            ''', (item['quantity'], item['product_id']))
-        
-        # Clear cart if this was a cart checkout
-        if 'current_order' not in context.user_data:
-            cursor.execute('DELETE FROM cart WHERE user_id = ?', (user.id,))
-        
-        # Update discount code usage
-        if discount_code:
-            cursor.execute('''
-                UPDATE discount_codes SET used_count = used_count + 1 
-                WHERE code = ? AND (max_uses = -1 OR used_count < max_uses)
-            ''', (discount_code,))
-        
-        conn.commit()
-        conn.close()
+        # The order clears the cart table, so pending cart changes must land first
+        clear_cart = 'current_order' not in context.user_data
+        if clear_cart:
+            await cart_store.flush_user(user.id)
+
+        # Create order record, clearing the cart if this was a cart checkout
+        result = await adb.create_order(
+            order_id=order_id,
+            user_id=user.id,
+            user_name=user.username or user.first_name,
+            items=checkout_items,
+            total=total,
+            currency=currency,
+            payment_source=payment_source,
+            discount_code=discount_code,
+            clear_cart=clear_cart,
+            user_label=f"@{user.username}" if user.username else user.first_name
+        )
         
         # Clear temporary data
         context.user_data.pop('checkout_total', None)
@@ -697,8 +645,17 @@ Example: `1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa`"""
         context.user_data.pop('current_order', None)
         context.user_data.pop('discount_code', None)
         
-        # Notify admin
-        await self.notify_admin_of_payment(context, user, order_id, total, currency, payment_source, discount_code)
+        if result['status'] != 'placed':
+            # Nothing was written, the cart is left as it was
+            await update.message.reply_text(self.format_order_failure(result, discount_code))
+            await self.start(update, context)
+            return ConversationHandler.END
+        
+        if clear_cart:
+            cart_store.forget(user.id)
+
+        # The admin notification was committed with the order, deliver it now
+        outbox.kick(context.job_queue)
         
         text = f"""✅ Notified admin of your payment!
 🆔 Order ID: {order_id}
@@ -713,45 +670,44 @@ Admin will check your transaction and send products after confirmation."""
         await self.start(update, context)
         return ConversationHandler.END
     
-    async def notify_admin_of_payment(self, context: ContextTypes.DEFAULT_TYPE, user, order_id: str, total: float, currency: str, payment_source: str, discount_code: str = None):
-        user_info = f"@{user.username}" if user.username else user.first_name
-        
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT product_name FROM orders WHERE order_id = ? LIMIT 1', (order_id,))
-        order = cursor.fetchone()
-        conn.close()
-        
-        product_name = order[0] if order else "Cart checkout"
+    def format_order_failure(self, result: dict, discount_code: str = None) -> str:
+        if result['status'] == 'empty':
+            return "❌ There is nothing to order. Your order was not placed, please add products to your cart and check out again."
+        if result['status'] == 'discount_unavailable':
+            return f"❌ Discount code {discount_code} can no longer be used. Your order was not placed, please check out again."
+        
+        lines = [f"• {name}: {requested} requested, {available} left" for name, requested, available in result['short']]
+        return "❌ Not enough stock for:\n" + "\n".join(lines) + "\n\nYour order was not placed, please update your cart and check out again."
+    
+    async def notify_admin_of_payment(self, payload: dict):
+        order_id = payload['order_id']
+        product_name = payload['product_name'] or "Cart checkout"
+        discount_code = payload['discount_code']
         
         text = f"""🔄 PAYMENT AWAITING CONFIRMATION!
 
-👤 Client: {user_info}
-🆔 User ID: {user.id}
+👤 Client: {payload['client']}
+🆔 User ID: {payload['user_id']}
 🛍️ Product: {product_name}
-💰 Price: {total:.2f}€
+💰 Price: {payload['total']:.2f}€
 🆔 Order ID: {order_id}
-⛓️ Crypto: {currency.upper()}
-📧 Payment source address: {payment_source}
+⛓️ Crypto: {payload['currency'].upper()}
+📧 Payment source address: {payload['payment_source']}
 🎫 Discount Code: {discount_code if discount_code else 'None'}
-⏰ Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+⏰ Time: {payload['created_at']}
 
 Is payment visible in your wallet?"""
         
         keyboard = [
             [
-                InlineKeyboardButton("✅ Confirm Payment", callback_data=f"admin_confirm_{order_id}"),
-                InlineKeyboardButton("❌ Reject", callback_data=f"admin_reject_{order_id}")
+                InlineKeyboardButton("✅ Confirm Payment", callback_data=self.router.data("admin_confirm_", order_id)),
+                InlineKeyboardButton("❌ Reject", callback_data=self.router.data("admin_reject_", order_id))
             ]
         ]
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await context.bot.send_message(
-            chat_id=self.admin_id,
-            text=text,
-            reply_markup=reply_markup
-        )
+        await send_queue.send_message(self.admin_id, text, priority=PRIORITY_HIGH, reply_markup=reply_markup)
     
     # PAYMENT CONFIRMATION SYSTEM - PILDID SAADETAKSE KLIENTIDELE ALLA
     async def ask_admin_confirmation(self, update: Update, context: ContextTypes.DEFAULT_TYPE, order_id: str):
@@ -764,8 +720,8 @@ Are you sure you want to approve this payment?
 
         keyboard = [
             [
-                InlineKeyboardButton("✅ YES, confirm payment", callback_data=f"admin_confirm_yes_{order_id}"),
-                InlineKeyboardButton("❌ NO, cancel", callback_data=f"admin_confirm_no_{order_id}")
+                InlineKeyboardButton("✅ YES, confirm payment", callback_data=self.router.data("admin_confirm_yes_", order_id)),
+                InlineKeyboardButton("❌ NO, cancel", callback_data=self.router.data("admin_confirm_no_", order_id))
             ]
         ]
 
@@ -776,57 +732,83 @@ Are you sure you want to approve this payment?
 
     async def confirm_payment(self, update: Update, context: ContextTypes.DEFAULT_TYPE, order_id: str):
         """Kinnitab makse ja saadab kliendile pildid/koordinaadid"""
-        conn = db.get_connection()
-        cursor = conn.cursor()
-
-        # Võtame kõik selle tellimuse tooted
-        cursor.execute('SELECT user_id, product_id, product_name, quantity FROM orders WHERE order_id = ?', (order_id,))
-        orders = cursor.fetchall()
-
-        # Muudame tellimuse staatuse "completed"
-        cursor.execute('UPDATE orders SET status = ? WHERE order_id = ?', ('completed', order_id))
-        conn.commit()
+        # Muudame tellimuse staatuse "completed" ja võtame kõik selle tellimuse tooted
+        # Kliendi teavitus salvestatakse outboxi samas tehingus
+        deliveries = await adb.complete_order(order_id)
+        query = update.callback_query
+        if deliveries is None:
+            await query.edit_message_text(f"⚠️ Order {order_id} is no longer pending (expired or already handled).")
+            return
+        outbox.kick(context.job_queue)
 
-        # Saadame kliendile toote pildid ja koordinaadid
-        for order in orders:
-            user_id, product_id, product_name, quantity = order
+        # Uuendame admini teadet
+        await query.edit_message_text(f"✅ Payment for order {order_id} confirmed and client notified!")
 
-            # Võtame toote pildid ja koordinaadid andmebaasist
-            cursor.execute('SELECT image1, image2, coordinates FROM products WHERE id = ?', (product_id,))
-            product = cursor.fetchone()
+    async def send_order_delivery(self, payload: dict, delivered: set):
+        """Saadab kliendile toote pildid ja koordinaadid"""
+        # Juba saadetud sõnumeid korduskatsel uuesti ei saadeta
+        sends = self.deliver_order(payload['order_id'], payload['deliveries'], skip=delivered)
+        results = await asyncio.gather(*sends.values(), return_exceptions=True)
+        errors = []
+        for key, result in zip(sends, results):
+            if isinstance(result, Exception):
+                errors.append(result)
+            else:
+                delivered.add(key)
+        if errors:
+            raise errors[0]
 
-            if product:
-                image1, image2, coordinates = product
+    def deliver_order(self, order_id: str, deliveries, skip=()):
+        """Saadab kliendile kinnitusteate ja kõik tellimuse pildid albumitena.
 
-                # Saadame kliendile kinnitusteate
-                text = f"✅ Your payment has been confirmed!\n\n🛍️ Product: {product_name}\n📦 Quantity: {quantity}"
+        Returns the send futures keyed by the message's position in the
+        delivery; messages whose key is in ``skip`` are not sent.
+        """
+        user_id = deliveries[0][0]
+        text_only = []
+        photos = []
 
-                if coordinates:
-                    text += f"\n📍 Location: {coordinates}"
+        for _, product_name, quantity, image1, image2, coordinates in deliveries:
+            caption = f"🛍️ Product: {product_name}\n📦 Quantity: {quantity}"
+            if coordinates:
+                caption += f"\n📍 Location: {coordinates}"
 
-                # Saadame teksti
-                await context.bot.send_message(chat_id=user_id, text=text)
+            images = [image for image in (image1, image2) if image]
+            if not images:
+                text_only.append(caption)
+                continue
 
-                # SAADAME PILDID kliendile (need ei olnud enne maksmist nähtavad)
-                if image1:
-                    await context.bot.send_photo(chat_id=user_id, photo=image1, caption="Product image 1")
-                if image2:
-                    await context.bot.send_photo(chat_id=user_id, photo=image2, caption="Product image 2")
+            # Toote kirjeldus läheb selle toote esimese pildi alla
+            photos.append(InputMediaPhoto(images[0], caption=caption))
+            photos.extend(InputMediaPhoto(image) for image in images[1:])
 
-        conn.close()
+        # Kinnitusteade ja piltideta tooted ühes sõnumis
+        text = f"✅ Your payment has been confirmed!\n🆔 Order ID: {order_id}"
+        if text_only:
+            text += "\n\n" + "\n\n".join(text_only)
+        sends = {}
+        if 0 not in skip:
+            sends[0] = send_queue.send_message(user_id, text, priority=PRIORITY_HIGH)
 
-        # Uuendame admini teadet
-        query = update.callback_query
-        await query.edit_message_text(f"✅ Payment for order {order_id} confirmed and client notified!")
+        # Albums of at most ten, split evenly so no album is left with a single photo
+        if not photos:
+            return sends
+        album_count = -(-len(photos) // MEDIA_GROUP_SIZE)
+        album_size = -(-len(photos) // album_count)
+        for key, start in enumerate(range(0, len(photos), album_size), start=1):
+            if key in skip:
+                continue
+            album = photos[start:start + album_size]
+            if len(album) == 1:
+                sends[key] = send_queue.send_photo(user_id, album[0].media, priority=PRIORITY_HIGH, caption=album[0].caption)
+            else:
+                sends[key] = send_queue.send_media_group(user_id, album, priority=PRIORITY_HIGH)
+        return sends
 
     async def cancel_confirmation(self, update: Update, context: ContextTypes.DEFAULT_TYPE, order_id: str):
         """Tühistab admini kinnituse"""
         # Läheme tagasi algse makse teate juurde
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id, user_name, product_name, total_price, payment_currency, payment_source_address, discount_code FROM orders WHERE order_id = ? LIMIT 1', (order_id,))
-        order = cursor.fetchone()
-        conn.close()
+        order = await adb.get_order_summary(order_id)
 
         if order:
             user_id, user_name, product_name, total_price, payment_currency, payment_source_address, discount_code = order
@@ -847,8 +829,8 @@ Is payment visible in your wallet?"""
 
             keyboard = [
                 [
-                    InlineKeyboardButton("✅ Confirm Payment", callback_data=f"admin_confirm_{order_id}"),
-                    InlineKeyboardButton("❌ Reject", callback_data=f"admin_reject_{order_id}")
+                    InlineKeyboardButton("✅ Confirm Payment", callback_data=self.router.data("admin_confirm_", order_id)),
+                    InlineKeyboardButton("❌ Reject", callback_data=self.router.data("admin_reject_", order_id))
                 ]
             ]
 
@@ -859,37 +841,38 @@ Is payment visible in your wallet?"""
 
     async def reject_payment(self, update: Update, context: ContextTypes.DEFAULT_TYPE, order_id: str):
         """Lükkab makse tagasi"""
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('UPDATE orders SET status = ? WHERE order_id = ?', ('rejected', order_id))
-        conn.commit()
-
-        # Teavitame klienti
-        cursor.execute('SELECT user_id FROM orders WHERE order_id = ? LIMIT 1', (order_id,))
-        order = cursor.fetchone()
-        if order:
-            user_id = order[0]
-            await context.bot.send_message(
-                chat_id=user_id, 
-                text=f"❌ Your payment for order {order_id} has been rejected. Please contact admin."
-            )
-
-        conn.close()
-
+        # Kliendi teavitus salvestatakse outboxi samas tehingus
+        user_id = await adb.reject_order(order_id)
         query = update.callback_query
+        if user_id is None:
+            await query.edit_message_text(f"⚠️ Order {order_id} is no longer pending (expired or already handled).")
+            return
+        outbox.kick(context.job_queue)
+
         await query.edit_message_text(f"❌ Payment for order {order_id} rejected!")
     
+    async def send_rejection_notice(self, payload: dict):
+        """Teavitab klienti tagasi lükatud maksest"""
+        await send_queue.send_message(
+            payload['user_id'],
+            f"❌ Your payment for order {payload['order_id']} has been rejected. Please contact admin."
+        )
+    
+    async def send_expiry_notice(self, payload: dict):
+        """Teavitab klienti aegunud tellimusest"""
+        await send_queue.send_message(
+            payload['user_id'],
+            f"⌛ Your order {payload['order_id']} has expired because the payment was not confirmed in time. "
+            "If you already paid, please contact admin."
+        )
+    
     # STATIC CONTENT METHODS
-    def get_content(self, key: str) -> str:
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT value FROM content WHERE key = ?', (key,))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else "Content not found"
+    async def get_content(self, key: str) -> str:
+        value = await reference_cache.get_content(key)
+        return value if value is not None else "Content not found"
     
     async def show_about(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        text = self.get_content('about_us')
+        text = await self.get_content('about_us')
         keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="main_menu")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -897,7 +880,7 @@ Is payment visible in your wallet?"""
         await query.edit_message_text(text, reply_markup=reply_markup)
     
     async def show_contact(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        text = self.get_content('contact')
+        text = await self.get_content('contact')
         keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="main_menu")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -905,7 +888,7 @@ Is payment visible in your wallet?"""
         await query.edit_message_text(text, reply_markup=reply_markup)
     
     async def show_website(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        website_url = self.get_content('website')
+        website_url = await self.get_content('website')
         text = f"🌐 Visit our website: {website_url}"
         keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="main_menu")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -914,7 +897,7 @@ Is payment visible in your wallet?"""
         await query.edit_message_text(text, reply_markup=reply_markup)
     
     async def show_rules(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        text = self.get_content('rules')
+        text = await self.get_content('rules')
         keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="main_menu")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -922,7 +905,7 @@ Is payment visible in your wallet?"""
         await query.edit_message_text(text, reply_markup=reply_markup)
     
     async def show_faq(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        text = self.get_content('faq')
+        text = await self.get_content('faq')
         keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="main_menu")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -945,6 +928,7 @@ Is payment visible in your wallet?"""
             [InlineKeyboardButton("💳 Payment Settings", callback_data="payment_settings")],
             [InlineKeyboardButton("🎫 Discount Codes", callback_data="discount_codes")],
             [InlineKeyboardButton("📊 Statistics", callback_data="statistics")],
+            [InlineKeyboardButton("💾 Backups", callback_data="backups")],
             [InlineKeyboardButton("🔙 Main Menu", callback_data="main_menu")]
         ]
         
@@ -955,17 +939,18 @@ Is payment visible in your wallet?"""
         else:
             await update.message.reply_text(text, reply_markup=reply_markup)
     
-    async def show_product_management(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def show_product_management(self, update: Update, context: ContextTypes.DEFAULT_TYPE, after_id: int = None, before_id: int = None):
         user_id = update.effective_user.id
         if user_id != self.admin_id:
             await update.callback_query.answer("Access denied!", show_alert=True)
             return
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT id, name, price, active FROM products ORDER BY name')
-        products = cursor.fetchall()
-        conn.close()
+        products, has_more = await adb.get_products_page(after_id, before_id, PRODUCTS_PAGE_SIZE)
+        
+        # The cursor product was deleted, start over from the first page
+        if not products and (after_id is not None or before_id is not None):
+            products, has_more = await adb.get_products_page(limit=PRODUCTS_PAGE_SIZE)
+            after_id = before_id = None
         
         text = "📦 Product Management:"
         
@@ -975,16 +960,22 @@ Is payment visible in your wallet?"""
             status = "✅" if active else "❌"
             keyboard.append([InlineKeyboardButton(
                 f"{status} {name} - {price}€", 
-                callback_data=f"edit_product_{product_id}"
+                callback_data=self.router.data("edit_product_", product_id)
             )])
         
+        navigation = self.page_navigation(products, has_more, after_id, before_id, "admin_products")
+        if navigation:
+            keyboard.append(navigation)
+        
         keyboard.append([InlineKeyboardButton("➕ Add New Product", callback_data="add_new_product")])
         keyboard.append([InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_panel")])
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        query = update.callback_query
-        await query.edit_message_text(text, reply_markup=reply_markup)
+        if update.callback_query:
+            await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+        else:
+            await update.message.reply_text(text, reply_markup=reply_markup)
     
     async def start_add_product(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
@@ -1075,24 +1066,15 @@ Is payment visible in your wallet?"""
         
         # Save product to database
         product_data = context.user_data['new_product']
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO products (name, price, description, quantity, image1, image2, coordinates, active)
-            VALUES (?, ?, ?, ?, ?, ?, ?, TRUE)
-        ''', (
-            product_data['name'],
-            product_data['price'],
-            product_data['description'],
-            product_data['quantity'],
-            product_data.get('image1'),
-            product_data.get('image2'),
-            product_data.get('coordinates')
-        ))
-        
-        conn.commit()
-        conn.close()
+        await adb.add_product(
+            name=product_data['name'],
+            price=product_data['price'],
+            description=product_data['description'],
+            quantity=product_data['quantity'],
+            image1=product_data.get('image1'),
+            image2=product_data.get('image2'),
+            coordinates=product_data.get('coordinates')
+        )
         
         # Prepare completion message
         coord_message = f"📍 Coordinates: {product_data.get('coordinates') or 'Not set'}\n\n" if product_data.get('coordinates') else ""
@@ -1121,11 +1103,7 @@ Product is now available to clients."""
             await update.callback_query.answer("Access denied!", show_alert=True)
             return
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT name, price, description, quantity, coordinates, active FROM products WHERE id = ?', (product_id,))
-        product = cursor.fetchone()
-        conn.close()
+        product = await adb.get_product_for_edit(product_id)
         
         if not product:
             await update.callback_query.edit_message_text("Product not found!")
@@ -1142,15 +1120,15 @@ Product is now available to clients."""
 🎯 Status: {status}"""
         
         keyboard = [
-            [InlineKeyboardButton("✏️ Edit Name", callback_data=f"edit_name_{product_id}")],
-            [InlineKeyboardButton("💰 Edit Price", callback_data=f"edit_price_{product_id}")],
-            [InlineKeyboardButton("📝 Edit Description", callback_data=f"edit_description_{product_id}")],
-            [InlineKeyboardButton("📦 Edit Quantity", callback_data=f"edit_quantity_{product_id}")],
-            [InlineKeyboardButton("📍 Edit Coordinates", callback_data=f"edit_coordinates_{product_id}")],
-            [InlineKeyboardButton("🖼️ Add/Replace Image 1", callback_data=f"edit_image1_{product_id}")],
-            [InlineKeyboardButton("🖼️ Add/Replace Image 2", callback_data=f"edit_image2_{product_id}")],
-            [InlineKeyboardButton("🔄 Toggle Active", callback_data=f"toggle_active_{product_id}")],
-            [InlineKeyboardButton("🗑️ Delete Product", callback_data=f"delete_product_{product_id}")],
+            [InlineKeyboardButton("✏️ Edit Name", callback_data=self.router.data("edit_name_", product_id))],
+            [InlineKeyboardButton("💰 Edit Price", callback_data=self.router.data("edit_price_", product_id))],
+            [InlineKeyboardButton("📝 Edit Description", callback_data=self.router.data("edit_description_", product_id))],
+            [InlineKeyboardButton("📦 Edit Quantity", callback_data=self.router.data("edit_quantity_", product_id))],
+            [InlineKeyboardButton("📍 Edit Coordinates", callback_data=self.router.data("edit_coordinates_", product_id))],
+            [InlineKeyboardButton("🖼️ Add/Replace Image 1", callback_data=self.router.data("edit_image1_", product_id))],
+            [InlineKeyboardButton("🖼️ Add/Replace Image 2", callback_data=self.router.data("edit_image2_", product_id))],
+            [InlineKeyboardButton("🔄 Toggle Active", callback_data=self.router.data("toggle_active_", product_id))],
+            [InlineKeyboardButton("🗑️ Delete Product", callback_data=self.router.data("delete_product_", product_id))],
             [InlineKeyboardButton("🔙 Back to Products", callback_data="product_management")]
         ]
         
@@ -1165,11 +1143,7 @@ Product is now available to clients."""
             await update.callback_query.answer("Access denied!", show_alert=True)
             return
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT name, price FROM products WHERE id = ?', (product_id,))
-        product = cursor.fetchone()
-        conn.close()
+        product = await adb.get_product_name_price(product_id)
         
         if not product:
             await update.callback_query.edit_message_text("Product not found!")
@@ -1188,8 +1162,8 @@ Are you sure you want to delete this product?
         
         keyboard = [
             [
-                InlineKeyboardButton("✅ YES, delete", callback_data=f"confirm_delete_{product_id}"),
-                InlineKeyboardButton("❌ NO, cancel", callback_data=f"cancel_delete_{product_id}")
+                InlineKeyboardButton("✅ YES, delete", callback_data=self.router.data("confirm_delete_", product_id)),
+                InlineKeyboardButton("❌ NO, cancel", callback_data=self.router.data("cancel_delete_", product_id))
             ]
         ]
         
@@ -1204,15 +1178,84 @@ Are you sure you want to delete this product?
             await update.callback_query.answer("Access denied!", show_alert=True)
             return
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM products WHERE id = ?', (product_id,))
-        conn.commit()
-        conn.close()
+        await adb.delete_product(product_id)
         
         await update.callback_query.answer("Product deleted!")
         await self.show_product_management(update, context)
     
+    async def toggle_product_active(self, update: Update, context: ContextTypes.DEFAULT_TYPE, product_id: int):
+        user_id = update.effective_user.id
+        if user_id != self.admin_id:
+            await update.callback_query.answer("Access denied!", show_alert=True)
+            return
+        
+        active = await adb.toggle_product_active(product_id)
+        if active is None:
+            await update.callback_query.answer("Product not found!", show_alert=True)
+            return
+        
+        await update.callback_query.answer("Product activated!" if active else "Product deactivated!")
+        await self.show_product_edit(update, context, product_id)
+    
+    async def start_edit_product_field(self, update: Update, context: ContextTypes.DEFAULT_TYPE, product_id: int, field: str):
+        user_id = update.effective_user.id
+        if user_id != self.admin_id:
+            await update.callback_query.answer("Access denied!", show_alert=True)
+            return ConversationHandler.END
+        
+        context.user_data['product_edit'] = {'product_id': product_id, 'field': field}
+        await update.callback_query.edit_message_text(PRODUCT_EDIT_FIELDS[field])
+        return PRODUCT_EDIT_VALUE
+    
+    async def receive_product_field_value(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        product_edit = context.user_data.get('product_edit')
+        if not product_edit:
+            return ConversationHandler.END
+        
+        field = product_edit['field']
+        
+        if field in ('image1', 'image2'):
+            if not update.message.photo:
+                await update.message.reply_text("Please send an image file:")
+                return PRODUCT_EDIT_VALUE
+            value = update.message.photo[-1].file_id
+        elif not update.message.text:
+            await update.message.reply_text(PRODUCT_EDIT_FIELDS[field])
+            return PRODUCT_EDIT_VALUE
+        elif field == 'price':
+            try:
+                value = float(update.message.text)
+            except ValueError:
+                await update.message.reply_text("Invalid price format. Please enter a number (example: 25.00):")
+                return PRODUCT_EDIT_VALUE
+        elif field == 'quantity':
+            try:
+                value = int(update.message.text)
+            except ValueError:
+                await update.message.reply_text("Invalid quantity. Please enter a whole number (example: 5):")
+                return PRODUCT_EDIT_VALUE
+        elif field == 'coordinates':
+            value = update.message.text.strip()
+            if value.lower() == 'skip':
+                value = None
+            else:
+                try:
+                    lat, lon = map(float, value.split(','))
+                except ValueError:
+                    await update.message.reply_text("Invalid coordinates format. Please use format: 59.4370, 24.7536\nOr send 'skip' to clear them.")
+                    return PRODUCT_EDIT_VALUE
+        else:
+            value = update.message.text
+        
+        context.user_data.pop('product_edit')
+        await adb.update_product_field(product_edit['product_id'], field, value)
+        
+        keyboard = [[InlineKeyboardButton("🔙 Back to Product", callback_data=self.router.data("edit_product_", product_edit['product_id']))]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await update.message.reply_text("✅ Product updated!", reply_markup=reply_markup)
+        return ConversationHandler.END
+    
     # Additional admin functions would continue here...
     # For brevity, I'm showing the most critical functions
     
@@ -1225,13 +1268,13 @@ Are you sure you want to delete this product?
         text = "📝 Content Management:"
         
         keyboard = [
-            [InlineKeyboardButton("👋 Welcome Message", callback_data="edit_content_welcome_message")],
-            [InlineKeyboardButton("ℹ️ About Us", callback_data="edit_content_about_us")],
-            [InlineKeyboardButton("📞 Contact", callback_data="edit_content_contact")],
-            [InlineKeyboardButton("🌐 Website", callback_data="edit_content_website")],
-            [InlineKeyboardButton("📝 Rules", callback_data="edit_content_rules")],
-            [InlineKeyboardButton("🔍 FAQ", callback_data="edit_content_faq")],
-            [InlineKeyboardButton("🎉 Success Message", callback_data="edit_content_success_message")],
+            [InlineKeyboardButton("👋 Welcome Message", callback_data=self.router.data("edit_content_", "welcome_message"))],
+            [InlineKeyboardButton("ℹ️ About Us", callback_data=self.router.data("edit_content_", "about_us"))],
+            [InlineKeyboardButton("📞 Contact", callback_data=self.router.data("edit_content_", "contact"))],
+            [InlineKeyboardButton("🌐 Website", callback_data=self.router.data("edit_content_", "website"))],
+            [InlineKeyboardButton("📝 Rules", callback_data=self.router.data("edit_content_", "rules"))],
+            [InlineKeyboardButton("🔍 FAQ", callback_data=self.router.data("edit_content_", "faq"))],
+            [InlineKeyboardButton("🎉 Success Message", callback_data=self.router.data("edit_content_", "success_message"))],
             [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_panel")]
         ]
         
@@ -1246,30 +1289,18 @@ Are you sure you want to delete this product?
             await update.callback_query.answer("Access denied!", show_alert=True)
             return
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT currency_code, address, blockchain FROM payment_settings')
-        payment_methods = cursor.fetchall()
-        conn.close()
+        payment_methods = await reference_cache.get_payment_methods()
         
         text = "💳 Payment Settings:\n\n"
         
         keyboard = []
-        for method in payment_methods:
-            currency_code, address, blockchain = method
-            currency_name = {
-                'btc': '₿ Bitcoin',
-                'eth': 'Ξ Ethereum', 
-                'sol': '◎ Solana',
-                'ltc': '💎 Litecoin',
-                'usdt': '💵 USDT'
-            }.get(currency_code, currency_code.upper())
-            
+        for currency_code, address, blockchain in payment_methods:
+            currency_name = CURRENCY_LABELS.get(currency_code, currency_code.upper())
             text += f"{currency_name}:\n`{address}`\n\n"
             
             keyboard.append([
-                InlineKeyboardButton(f"✏️ Edit {currency_name}", callback_data=f"edit_payment_{currency_code}"),
-                InlineKeyboardButton(f"🗑️ Remove {currency_name}", callback_data=f"remove_payment_{currency_code}")
+                InlineKeyboardButton(f"✏️ Edit {currency_name}", callback_data=self.router.data("edit_payment_", currency_code)),
+                InlineKeyboardButton(f"🗑️ Remove {currency_name}", callback_data=self.router.data("remove_payment_", currency_code))
             ])
         
         keyboard.append([InlineKeyboardButton("➕ Add New Crypto", callback_data="add_new_crypto")])
@@ -1280,6 +1311,103 @@ Are you sure you want to delete this product?
         query = update.callback_query
         await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
     
+    async def start_edit_content(self, update: Update, context: ContextTypes.DEFAULT_TYPE, content_key: str):
+        user_id = update.effective_user.id
+        if user_id != self.admin_id:
+            await update.callback_query.answer("Access denied!", show_alert=True)
+            return ConversationHandler.END
+        
+        context.user_data['edit_content_key'] = content_key
+        current_text = await self.get_content(content_key)
+        
+        await update.callback_query.edit_message_text(f"Current text:\n\n{current_text}\n\nSend the new text:")
+        return CONTENT_EDIT
+    
+    async def receive_content_edit(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        content_key = context.user_data.pop('edit_content_key', None)
+        if not content_key:
+            return ConversationHandler.END
+        
+        await adb.update_content(content_key, update.message.text)
+        
+        keyboard = [[InlineKeyboardButton("🔙 Back to Content Management", callback_data="content_management")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await update.message.reply_text("✅ Content updated!", reply_markup=reply_markup)
+        return ConversationHandler.END
+    
+    async def start_edit_payment(self, update: Update, context: ContextTypes.DEFAULT_TYPE, currency: str):
+        user_id = update.effective_user.id
+        if user_id != self.admin_id:
+            await update.callback_query.answer("Access denied!", show_alert=True)
+            return ConversationHandler.END
+        
+        payment_method = await reference_cache.get_payment_method(currency)
+        if not payment_method:
+            await update.callback_query.edit_message_text("Payment method not found!")
+            return ConversationHandler.END
+        
+        address, blockchain = payment_method
+        context.user_data['payment_edit'] = {'currency': currency, 'blockchain': blockchain}
+        
+        currency_name = CURRENCY_NAMES.get(currency, currency.upper())
+        await update.callback_query.edit_message_text(f"Current {currency_name} address:\n{address}\n\nEnter the new address:")
+        return PAYMENT_ADDRESS
+    
+    async def start_add_payment_method(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        if user_id != self.admin_id:
+            await update.callback_query.answer("Access denied!", show_alert=True)
+            return ConversationHandler.END
+        
+        context.user_data['payment_edit'] = {}
+        await update.callback_query.edit_message_text("Enter currency code (example: xmr):")
+        return PAYMENT_CURRENCY
+    
+    async def receive_payment_currency(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        currency = update.message.text.strip().lower()
+        if not currency.isalnum() or len(currency) > 10:
+            await update.message.reply_text("Invalid currency code. Use letters and digits only (example: xmr):")
+            return PAYMENT_CURRENCY
+        
+        context.user_data['payment_edit']['currency'] = currency
+        await update.message.reply_text("Enter the wallet address:")
+        return PAYMENT_ADDRESS
+    
+    async def receive_payment_address(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        payment_edit = context.user_data['payment_edit']
+        payment_edit['address'] = update.message.text.strip()
+        
+        # Editing an existing method keeps its blockchain
+        if 'blockchain' in payment_edit:
+            return await self.save_payment_method(update, context)
+        
+        await update.message.reply_text("Enter the blockchain (example: Ethereum):")
+        return PAYMENT_BLOCKCHAIN
+    
+    async def receive_payment_blockchain(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        context.user_data['payment_edit']['blockchain'] = update.message.text.strip()
+        return await self.save_payment_method(update, context)
+    
+    async def save_payment_method(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        payment_edit = context.user_data.pop('payment_edit')
+        await adb.upsert_payment_method(payment_edit['currency'], payment_edit['address'], payment_edit['blockchain'])
+        
+        keyboard = [[InlineKeyboardButton("🔙 Back to Payment Settings", callback_data="payment_settings")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await update.message.reply_text(f"✅ Payment method {payment_edit['currency'].upper()} saved!", reply_markup=reply_markup)
+        return ConversationHandler.END
+    
+    async def remove_payment_method(self, update: Update, context: ContextTypes.DEFAULT_TYPE, currency: str):
+        user_id = update.effective_user.id
+        if user_id != self.admin_id:
+            await update.callback_query.answer("Access denied!", show_alert=True)
+            return
+        
+        await adb.delete_payment_method(currency)
+        await self.show_payment_settings(update, context)
+    
     async def show_discount_management(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         if user_id != self.admin_id:
@@ -1306,52 +1434,25 @@ Are you sure you want to delete this product?
             await update.callback_query.answer("Access denied!", show_alert=True)
             return
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        # Product statistics
-        cursor.execute('SELECT COUNT(*) FROM products')
-        total_products = cursor.fetchone()[0]
-        cursor.execute('SELECT COUNT(*) FROM products WHERE active = TRUE')
-        active_products = cursor.fetchone()[0]
-        
-        # Order statistics
-        cursor.execute('SELECT COUNT(*) FROM orders')
-        total_orders = cursor.fetchone()[0]
-        cursor.execute('SELECT COUNT(*) FROM orders WHERE status = "completed"')
-        completed_orders = cursor.fetchone()[0]
-        cursor.execute('SELECT COUNT(*) FROM orders WHERE status = "pending"')
-        pending_orders = cursor.fetchone()[0]
-        
-        # Cart statistics
-        cursor.execute('SELECT COUNT(*) FROM cart')
-        products_in_carts = cursor.fetchone()[0]
-        
-        # Discount code statistics
-        cursor.execute('SELECT COUNT(*) FROM discount_codes')
-        total_codes = cursor.fetchone()[0]
-        cursor.execute('SELECT COUNT(*) FROM discount_codes WHERE active = TRUE')
-        active_codes = cursor.fetchone()[0]
-        
-        conn.close()
+        stats = await adb.get_statistics()
         
         text = f"""📊 STORE STATISTICS
 
 🛍️ PRODUCTS:
-• All products: {total_products}
-• Active products: {active_products}
+• All products: {stats['total_products']}
+• Active products: {stats['active_products']}
 
 📦 ORDERS:
-• All orders: {total_orders}
-• Completed: {completed_orders}
-• Pending: {pending_orders}
+• All orders: {stats['total_orders']}
+• Completed: {stats['completed_orders']}
+• Pending: {stats['pending_orders']}
 
 🛒 CARTS:
-• Products in carts: {products_in_carts}
+• Products in carts: {stats['products_in_carts']}
 
 🎫 DISCOUNT CODES:
-• All codes: {total_codes}
-• Active: {active_codes}"""
+• All codes: {stats['total_codes']}
+• Active: {stats['active_codes']}"""
         
         keyboard = [[InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_panel")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1359,16 +1460,59 @@ Are you sure you want to delete this product?
         query = update.callback_query
         await query.edit_message_text(text, reply_markup=reply_markup)
     
+    async def show_backups(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if backup_manager.running:
+            copied, total = backup_manager.progress or (0, 0)
+            status = f"⏳ Running: {copied * 100 // total}% ({copied}/{total} pages)" if total else "⏳ Starting"
+        else:
+            status = "✅ Idle"
+        
+        last = backup_manager.last_result
+        if not last:
+            last_text = "None since start"
+        elif last['error']:
+            last_text = f"❌ Failed at {last['finished_at']:%Y-%m-%d %H:%M:%S}: {last['error']}"
+        else:
+            last_text = f"{os.path.basename(last['path'])} ({last['size'] / 1024 / 1024:.1f} MB, integrity ok)"
+        
+        text = f"""💾 DATABASE BACKUPS
+
+• Status: {status}
+• Last backup: {last_text}
+• Snapshots kept: {len(backup_manager.snapshots())} of {backup_manager.keep}"""
+        
+        keyboard = [
+            [InlineKeyboardButton("▶️ Start Backup", callback_data="start_backup")],
+            [InlineKeyboardButton("🔄 Refresh", callback_data="backups")],
+            [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_panel")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        query = update.callback_query
+        try:
+            await query.edit_message_text(text, reply_markup=reply_markup)
+        except BadRequest:
+            # Refreshed without any change in progress
+            pass
+    
+    async def start_backup(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if backup_manager.running:
+            await update.callback_query.answer("A backup is already running!")
+        else:
+            context.application.create_task(backup_manager.run())
+            await update.callback_query.answer("Backup started!")
+            # Let the backup take its lock so the panel already shows it running
+            await asyncio.sleep(0)
+        
+        await self.show_backups(update, context)
+    
     def setup_handlers(self, application):
         # Start command
         application.add_handler(CommandHandler("start", self.start))
         
-        # Button handler
-        application.add_handler(CallbackQueryHandler(self.button_handler))
-        
         # Add product conversation
         add_product_conv = ConversationHandler(
-            entry_points=[CallbackQueryHandler(self.start_add_product, pattern="^add_new_product$")],
+            entry_points=[CallbackQueryHandler(self.button_handler, pattern=self.router.pattern("add_new_product"))],
             states={
                 PRODUCT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.receive_product_name)],
                 PRODUCT_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.receive_product_price)],
@@ -1386,7 +1530,7 @@ Are you sure you want to delete this product?
         
         # Payment source address handler
         payment_conv = ConversationHandler(
-            entry_points=[CallbackQueryHandler(self.ask_payment_source_address, pattern="^payment_made$")],
+            entry_points=[CallbackQueryHandler(self.button_handler, pattern=self.router.pattern("payment_made"))],
             states={
                 PAYMENT_SOURCE_ADDRESS: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.receive_payment_source_address)],
             },
@@ -1397,7 +1541,7 @@ Are you sure you want to delete this product?
         
         # Discount code input handler
         discount_conv = ConversationHandler(
-            entry_points=[CallbackQueryHandler(self.ask_discount_code, pattern="^continue_to_payment$")],
+            entry_points=[CallbackQueryHandler(self.button_handler, pattern=self.router.pattern("continue_to_payment"))],
             states={
                 DISCOUNT_CODE_INPUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.receive_discount_code)],
             },
@@ -1405,10 +1549,139 @@ Are you sure you want to delete this product?
         )
         
         application.add_handler(discount_conv)
+        
+        # Product field editing conversation
+        product_edit_conv = ConversationHandler(
+            entry_points=[CallbackQueryHandler(
+                self.button_handler,
+                pattern=self.router.pattern(*(f"edit_{field}_" for field in PRODUCT_EDIT_FIELDS))
+            )],
+            states={
+                PRODUCT_EDIT_VALUE: [MessageHandler((filters.TEXT & ~filters.COMMAND) | filters.PHOTO, self.receive_product_field_value)],
+            },
+            fallbacks=[],
+        )
+        
+        application.add_handler(product_edit_conv)
+        
+        # Content editing conversation
+        content_conv = ConversationHandler(
+            entry_points=[CallbackQueryHandler(self.button_handler, pattern=self.router.pattern("edit_content_"))],
+            states={
+                CONTENT_EDIT: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.receive_content_edit)],
+            },
+            fallbacks=[],
+        )
+        
+        application.add_handler(content_conv)
+        
+        # Payment method editing conversation
+        payment_settings_conv = ConversationHandler(
+            entry_points=[
+                CallbackQueryHandler(self.button_handler, pattern=self.router.pattern("edit_payment_", "add_new_crypto"))
+            ],
+            states={
+                PAYMENT_CURRENCY: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.receive_payment_currency)],
+                PAYMENT_ADDRESS: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.receive_payment_address)],
+                PAYMENT_BLOCKCHAIN: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.receive_payment_blockchain)],
+            },
+            fallbacks=[],
+        )
+        
+        application.add_handler(payment_settings_conv)
+        
+        # Button handler goes last so conversation entry points see their callbacks first
+        application.add_handler(CallbackQueryHandler(self.button_handler))
 
-    def run(self):
-        application = Application.builder().token(self.token).build()
+    async def post_init(self, application):
+        await send_queue.start(application.bot)
+        # Also picks up notifications left over from before a restart
+        application.job_queue.run_repeating(outbox.run_job, interval=OUTBOX_INTERVAL, first=0)
+        application.job_queue.run_repeating(jobs.release_expired_holds, interval=STOCK_HOLD_SWEEP_INTERVAL)
+        application.job_queue.run_repeating(cart_store.run_job, interval=CART_FLUSH_INTERVAL)
+        application.job_queue.run_repeating(jobs.expire_pending_orders, interval=ORDER_EXPIRY_INTERVAL)
+        application.job_queue.run_repeating(jobs.clean_abandoned_carts, interval=CART_CLEANUP_INTERVAL)
+        application.job_queue.run_repeating(jobs.archive_orders, interval=ORDER_ARCHIVE_INTERVAL)
+        application.job_queue.run_repeating(jobs.backup_database, interval=BACKUP_INTERVAL)
+
+    async def post_shutdown(self, application):
+        await cart_store.flush()
+        await send_queue.stop()
+        adb.shutdown()
+
+    def build_application(self):
+        # Different users are served in parallel, each user's updates stay in order
+        update_processor = PerUserUpdateProcessor(
+            int(os.getenv('UPDATE_CONCURRENCY', 8)),
+            int(os.getenv('UPDATE_MAX_PENDING', 256))
+        )
+        builder = (
+            Application.builder()
+            .token(self.token)
+            .concurrent_updates(update_processor)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+        )
+        
+        # Point the bot at another Bot API server (self-hosted or a local fake for tests)
+        api_url = os.getenv('TELEGRAM_API_URL')
+        if api_url:
+            api_url = api_url.rstrip('/')
+            builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+        
+        application = builder.build()
         self.setup_handlers(application)
+        return application
+
+    async def run_webhook(self, application, stop_event=None):
+        secret_token = os.getenv('WEBHOOK_SECRET') or None
+        max_connections = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+        server = WebhookServer(
+            application,
+            listen=os.getenv('WEBHOOK_LISTEN', '127.0.0.1'),
+            port=int(os.getenv('WEBHOOK_PORT', 8443)),
+            path=os.getenv('WEBHOOK_PATH', '/webhook'),
+            secret_token=secret_token,
+            max_connections=max_connections
+        )
+        
+        if stop_event is None:
+            stop_event = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, stop_event.set)
+        
+        await application.initialize()
+        try:
+            await self.post_init(application)
+            
+            # Without a public URL the webhook is expected to be registered already
+            public_url = os.getenv('WEBHOOK_URL')
+            if public_url:
+                await application.bot.set_webhook(
+                    url=public_url,
+                    secret_token=secret_token,
+                    max_connections=max_connections,
+                    allowed_updates=Update.ALL_TYPES
+                )
+            
+            await application.start()
+            await server.start()
+            logger.info("Bot is running (webhook)...")
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            if application.running:
+                await application.stop()
+            await application.shutdown()
+            await self.post_shutdown(application)
+
+    def run(self):
+        application = self.build_application()
+        
+        if os.getenv('BOT_MODE', 'polling').lower() == 'webhook':
+            asyncio.run(self.run_webhook(application))
+            return
         
         logger.info("Bot is running...")
         application.run_polling()
@@ -0,0 +1,80 @@
+import logging
+
+from async_db import adb
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceCache:
+    """Read-through cache of the content and payment_settings tables.
+
+    Both tables are loaded together with one query and served from memory
+    until ``AsyncDatabase.reference_version`` moves, which every admin edit
+    of either table does.
+    """
+
+    def __init__(self, adb):
+        self.adb = adb
+        self._version = None
+        self._content = {}
+        self._payment_methods = ()
+        self._payment_by_code = {}
+
+    async def _refresh(self):
+        version = self.adb.reference_version
+        if version == self._version:
+            return
+
+        content, payment_methods = await self.adb.get_reference_data()
+        self._content = dict(content)
+        self._payment_methods = tuple(payment_methods)
+        self._payment_by_code = {code: (address, blockchain) for code, address, blockchain in payment_methods}
+
+        # An edit that landed while loading leaves the cache stale, reload next time
+        if self.adb.reference_version == version:
+            self._version = version
+
+    async def get_content(self, key):
+        await self._refresh()
+        return self._content.get(key)
+
+    async def get_payment_methods(self):
+        await self._refresh()
+        return self._payment_methods
+
+    async def get_payment_method(self, currency):
+        await self._refresh()
+        return self._payment_by_code.get(currency)
+
+
+class CatalogCache:
+    """Rendered catalog screens shared by every customer.
+
+    Pages are built once per ``AsyncDatabase.catalog_version`` by the
+    ``build`` coroutine passed to ``get_page`` and returned as-is until a
+    product row changes, so browsing is a dictionary lookup.
+    """
+
+    def __init__(self, adb):
+        self.adb = adb
+        self.version = None
+        self._pages = {}
+
+    async def get_page(self, key, build):
+        version = self.adb.catalog_version
+        if version != self.version:
+            self._pages = {}
+            self.version = version
+
+        page = self._pages.get(key)
+        if page is None:
+            page = await build()
+            # Don't keep a page built from rows that changed while it was rendered
+            if self.adb.catalog_version == version:
+                self._pages[key] = page
+        return page
+
+
+# Create global cache instances
+reference_cache = ReferenceCache(adb)
+catalog_cache = CatalogCache(adb)
@@ -0,0 +1,153 @@
+import zlib
+import base64
+import hashlib
+import hmac
+
+# Encoded callback data starts with a character outside the base64url
+# alphabet, so it can never be confused with a plain string callback
+MARKER = '~'
+
+# Telegram rejects callback data longer than this many bytes
+MAX_CALLBACK_DATA = 64
+
+CHECKSUM_SIZE = 3
+
+
+class CallbackDataError(ValueError):
+    pass
+
+
+def route_id(name):
+    """Stable two-byte id for a route name, independent of registration order."""
+    return zlib.crc32(name.encode()) & 0xFFFF
+
+
+def _write_varint(out, value):
+    # Zigzag so small negative numbers stay small too
+    value = (value << 1) ^ (value >> 63)
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(payload, position):
+    value = 0
+    shift = 0
+    while True:
+        if position >= len(payload):
+            raise CallbackDataError("Truncated integer")
+        byte = payload[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+        if shift > 63:
+            raise CallbackDataError("Integer too long")
+    return (value >> 1) ^ -(value & 1), position
+
+
+class CallbackCodec:
+    """Packs a route id and typed arguments into compact callback data.
+
+    The payload is ``route id (2 bytes) | arguments | checksum``, base64url
+    encoded without padding and prefixed with ``MARKER``. Argument types come
+    from the schema registered for the route, so no type tags are stored:
+    ``int`` is a zigzag varint and ``str`` a length-prefixed UTF-8 string.
+    The checksum is a keyed BLAKE2b digest, so corrupted or hand-crafted data
+    is rejected instead of reaching a handler.
+    """
+
+    def __init__(self, secret=b''):
+        self.secret = secret[:64]
+        self._schemas = {}
+
+    def register(self, name, arg_types):
+        key = route_id(name)
+        existing = self._schemas.get(key)
+        if existing is not None and existing[0] != name:
+            raise ValueError(f"Route id collision between {existing[0]!r} and {name!r}")
+        for arg_type in arg_types:
+            if arg_type not in (int, str):
+                raise ValueError(f"Unsupported callback argument type: {arg_type!r}")
+        self._schemas[key] = (name, tuple(arg_types))
+        return key
+
+    def _checksum(self, payload):
+        return hashlib.blake2b(payload, digest_size=CHECKSUM_SIZE, key=self.secret).digest()
+
+    def encode(self, name, *args):
+        key = route_id(name)
+        schema = self._schemas.get(key)
+        if schema is None or schema[0] != name:
+            raise KeyError(f"Unknown route: {name!r}")
+        arg_types = schema[1]
+        if len(args) != len(arg_types):
+            raise ValueError(f"Route {name!r} takes {len(arg_types)} arguments, got {len(args)}")
+
+        payload = bytearray(key.to_bytes(2, 'big'))
+        for arg_type, value in zip(arg_types, args):
+            if arg_type is int:
+                _write_varint(payload, int(value))
+            else:
+                raw = str(value).encode()
+                if len(raw) > 255:
+                    raise ValueError("Callback string argument too long")
+                payload.append(len(raw))
+                payload.extend(raw)
+        payload.extend(self._checksum(bytes(payload)))
+
+        data = MARKER + base64.urlsafe_b64encode(bytes(payload)).rstrip(b'=').decode()
+        if len(data.encode()) > MAX_CALLBACK_DATA:
+            raise ValueError(f"Callback data for {name!r} exceeds {MAX_CALLBACK_DATA} bytes")
+        return data
+
+    def decode(self, data):
+        """Returns ``(name, args)``; raises CallbackDataError on anything invalid."""
+        if not data.startswith(MARKER):
+            raise CallbackDataError("Not encoded callback data")
+
+        encoded = data[len(MARKER):]
+        try:
+            raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+        except (ValueError, TypeError):
+            raise CallbackDataError("Invalid base64")
+
+        if len(raw) < 2 + CHECKSUM_SIZE:
+            raise CallbackDataError("Payload too short")
+        payload, checksum = raw[:-CHECKSUM_SIZE], raw[-CHECKSUM_SIZE:]
+        if not hmac.compare_digest(self._checksum(payload), checksum):
+            raise CallbackDataError("Checksum mismatch")
+
+        schema = self._schemas.get(int.from_bytes(payload[:2], 'big'))
+        if schema is None:
+            raise CallbackDataError("Unknown route id")
+        name, arg_types = schema
+
+        args = []
+        position = 2
+        for arg_type in arg_types:
+            if arg_type is int:
+                value, position = _read_varint(payload, position)
+            else:
+                if position >= len(payload):
+                    raise CallbackDataError("Truncated string")
+                length = payload[position]
+                position += 1
+                if position + length > len(payload):
+                    raise CallbackDataError("Truncated string")
+                try:
+                    value = payload[position:position + length].decode()
+                except UnicodeDecodeError:
+                    raise CallbackDataError("Invalid string")
+                position += length
+            args.append(value)
+
+        if position != len(payload):
+            raise CallbackDataError("Trailing bytes")
+        return name, tuple(args)
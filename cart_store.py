@@ -0,0 +1,175 @@
+import os
+import logging
+from collections import OrderedDict
+
+from async_db import adb
+
+logger = logging.getLogger(__name__)
+
+
+class CartStore:
+    """Keeps active carts in memory and writes them back to the cart table.
+
+    Each cart is a ``{product_id: quantity}`` dict; carts are ordered by
+    last use and the least recently used clean ones are dropped past
+    ``max_users``. Changes only mark the cart dirty, ``flush`` writes dirty
+    carts in batches. A cart not in memory is loaded from the table, so
+    flushed carts survive a restart.
+
+    Stock holds are still written on every add, because other users'
+    availability depends on them. Names and prices come from a product
+    lookup that is reset whenever ``catalog_version`` changes.
+    """
+
+    def __init__(self, database, max_users=10000, flush_batch=500):
+        self.database = database
+        self.max_users = max_users
+        self.flush_batch = flush_batch
+        self._carts = OrderedDict()
+        self._dirty = set()
+        self._products = {}
+        self._products_version = None
+
+    async def _cart(self, user_id):
+        cart = self._carts.get(user_id)
+        if cart is None:
+            cart = await self.database.get_cart_lines(user_id)
+            # Another update may have loaded it while we were waiting
+            cart = self._carts.setdefault(user_id, cart)
+        self._carts.move_to_end(user_id)
+        self._evict()
+        return cart
+
+    def _evict(self):
+        if len(self._carts) <= self.max_users:
+            return
+        # The most recently used cart is the one being served, never drop it
+        for user_id in list(self._carts)[:-1]:
+            if len(self._carts) <= self.max_users:
+                break
+            # Dirty carts stay until they are flushed
+            if user_id not in self._dirty:
+                del self._carts[user_id]
+
+    async def _product_info(self, product_ids):
+        if self._products_version != self.database.catalog_version:
+            self._products = {}
+            self._products_version = self.database.catalog_version
+        missing = [product_id for product_id in product_ids if product_id not in self._products]
+        if missing:
+            self._products.update(await self.database.get_cart_products(missing))
+        return self._products
+
+    async def add(self, user_id, product_id):
+        """Adds one piece and holds the stock for it.
+
+        Returns a ``(status, name, quantity)`` tuple where status is
+        ``'added'``, ``'not_found'`` or ``'insufficient'`` and quantity is
+        what the cart line holds afterwards.
+        """
+        cart = await self._cart(user_id)
+        quantity = cart.get(product_id, 0) + 1
+
+        status, name = await self.database.hold_cart_line(user_id, product_id, quantity)
+        if status != 'held':
+            return status, name, None
+
+        cart[product_id] = quantity
+        self._dirty.add(user_id)
+        return 'added', name, quantity
+
+    async def set_quantities(self, user_id, quantities):
+        """Sets several cart lines at once from a ``{product_id: quantity}`` dict.
+
+        A quantity of 0 or less removes the line. Quantities above what is
+        available are capped at it, and lines for products that are gone
+        or sold out are left as they were. Returns the cart afterwards.
+        """
+        cart = await self._cart(user_id)
+        held = await self.database.hold_cart_lines(user_id, quantities)
+        for product_id, quantity in quantities.items():
+            if quantity <= 0:
+                cart.pop(product_id, None)
+            elif product_id in held:
+                cart[product_id] = held[product_id]
+        self._dirty.add(user_id)
+        return dict(cart)
+
+    async def remove(self, user_id, product_ids):
+        """Removes the given products from the cart and releases their holds."""
+        cart = await self._cart(user_id)
+        await self.database.release_holds(user_id, product_ids)
+        for product_id in product_ids:
+            cart.pop(product_id, None)
+        self._dirty.add(user_id)
+
+    async def get_items(self, user_id, active_only=True):
+        """Cart lines as ``(product_id, quantity, name, price)``, inactive products only if asked."""
+        cart = await self._cart(user_id)
+        products = await self._product_info(list(cart))
+        items = []
+        for product_id, quantity in cart.items():
+            product = products.get(product_id)
+            # Deleted products drop out of the cart
+            if product is None:
+                continue
+            name, price, active = product
+            if active_only and not active:
+                continue
+            items.append((product_id, quantity, name, price))
+        return items
+
+    async def clear(self, user_id):
+        # Written through, it also releases the user's holds
+        await self.database.clear_cart(user_id)
+        self._carts[user_id] = {}
+        self._carts.move_to_end(user_id)
+        self._dirty.discard(user_id)
+
+    async def flush_user(self, user_id):
+        """Writes the user's cart now if it has unflushed changes."""
+        if user_id in self._dirty:
+            self._dirty.discard(user_id)
+            await self.database.replace_carts({user_id: dict(self._carts.get(user_id, {}))})
+
+    def forget(self, user_id):
+        """Drops the in-memory cart after the database cleared it, e.g. at checkout."""
+        self._carts.pop(user_id, None)
+        self._dirty.discard(user_id)
+
+    def forget_idle(self, user_ids):
+        """Drops the carts the abandoned cart cleanup deleted.
+
+        A cart changed since it was last flushed is in use again and stays,
+        the next flush writes it back.
+        """
+        for user_id in user_ids:
+            if user_id not in self._dirty:
+                self._carts.pop(user_id, None)
+
+    async def flush(self):
+        """Writes all dirty carts, ``flush_batch`` users per transaction."""
+        flushed = 0
+        while self._dirty:
+            user_ids = [self._dirty.pop() for _ in range(min(self.flush_batch, len(self._dirty)))]
+            carts = {user_id: dict(self._carts.get(user_id, {})) for user_id in user_ids}
+            try:
+                await self.database.replace_carts(carts)
+            except Exception:
+                logger.exception("Flushing %d carts failed", len(carts))
+                self._dirty.update(user_ids)
+                break
+            flushed += len(carts)
+        self._evict()
+        return flushed
+
+    async def run_job(self, context):
+        await self.flush()
+
+
+# Create global cart store instance
+cart_store = CartStore(
+    adb,
+    max_users=int(os.getenv('CART_CACHE_USERS', 10000)),
+    flush_batch=int(os.getenv('CART_FLUSH_BATCH', 500))
+)
@@ -1,137 +1,765 @@
+import os
+import json
+import time
+import queue
 import sqlite3
 import logging
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+from migrations import migrate
 
 logger = logging.getLogger(__name__)
 
+# Connection tuning, applied once when a pooled connection is created
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 8192
+MMAP_SIZE = 64 * 1024 * 1024
+
+# Order statuses that no longer change, these are archived once old enough
+FINISHED_ORDER_STATUSES = ('completed', 'rejected', 'expired')
+
+# Stock held by other users' unexpired holds, for a query over products
+OTHERS_HOLDS_SQL = '''
+    COALESCE((
+        SELECT SUM(h.quantity) FROM stock_holds h
+        WHERE h.product_id = products.id AND h.user_id != ? AND h.expires_at > ?
+    ), 0)
+'''
+
+
+def to_cents(amount):
+    """Converts a euro amount to integer cents, rounding half up."""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
 class Database:
-    def __init__(self, db_path="store_bot.db"):
+    def __init__(self, db_path="store_bot.db", pool_size=5, hold_ttl=900, convert_auto_vacuum=False):
         self.db_path = db_path
-        self.init_db()
+        self.pool_size = pool_size
+        # Seconds a cart or checkout keeps its stock reserved
+        self.hold_ttl = hold_ttl
+        # Rebuild an existing file to enable incremental auto-vacuum on start
+        self.convert_auto_vacuum = convert_auto_vacuum
+        self._pool = queue.LifoQueue()
+        self._pool_lock = threading.Lock()
+        self._connections = []
+        # The schema is checked lazily on first use, never at import
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def ensure_schema(self):
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if not self._schema_ready:
+                self.init_db()
+                self._schema_ready = True
+
+    def _create_connection(self):
+        self.ensure_schema()
+        return self._connect()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False
+        )
+        # Must come before journal_mode to take effect on a new file
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._pool_lock:
+            if len(self._connections) < self.pool_size:
+                conn = self._create_connection()
+                self._connections.append(conn)
+                return conn
+
+        # Pool exhausted, wait for a connection to be returned
+        return self._pool.get()
+
+    @contextmanager
+    def connection(self):
+        """Borrows a pooled connection, committing on success and rolling back on error."""
+        conn = self._acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._pool.put(conn)
+
+    def close(self):
+        with self._pool_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+            self._pool = queue.LifoQueue()
+
+    def write(self, func, *args, **kwargs):
+        """Runs a cursor-first write operation in its own transaction."""
+        with self.connection() as conn:
+            return func(conn.cursor(), *args, **kwargs)
 
     def init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Products table
+        # Migrations manage their own transactions, so use a dedicated connection
+        conn = self._connect()
+        conn.isolation_level = None
+        try:
+            migrate(conn)
+
+            # A file created without incremental auto-vacuum only switches
+            # over when rebuilt, which locks it for the whole rebuild, so
+            # that only happens when asked for
+            cursor = conn.cursor()
+            cursor.execute('PRAGMA auto_vacuum')
+            if cursor.fetchone()[0] != 2:
+                if self.convert_auto_vacuum:
+                    logger.info("Rebuilding %s to enable incremental auto-vacuum", self.db_path)
+                    cursor.execute('VACUUM')
+                else:
+                    logger.warning(
+                        "%s still needs a rebuild to enable incremental auto-vacuum; "
+                        "set AUTO_VACUUM_CONVERT=1 for one start to run it", self.db_path
+                    )
+        finally:
+            conn.close()
+
+    # Read queries borrow a pooled connection. Write operations take the cursor
+    # of the transaction they run in, see write() and writer.WriteQueue.
+
+    # PRODUCT QUERIES
+    def _products_page(self, columns, condition, after_id, before_id, limit):
+        """Keyset page of products ordered by (name, id).
+
+        The cursor is the id of the last row of the previous page (``after_id``)
+        or the first row of the next page (``before_id``); its name is looked up
+        by primary key, so every page costs one index seek regardless of depth.
+        Returns ``(rows, has_more)`` where ``has_more`` tells whether another
+        page exists in the direction of travel.
+        """
+        sql = f'SELECT {columns} FROM products WHERE {condition}'
+        params = []
+
+        anchor_id = after_id if after_id is not None else before_id
+        if anchor_id is not None:
+            op = '>' if after_id is not None else '<'
+            sql += f' AND (name, id) {op} (SELECT name, id FROM products WHERE id = ?)'
+            params.append(anchor_id)
+
+        direction = 'DESC' if before_id is not None else 'ASC'
+        sql += f' ORDER BY name {direction}, id {direction} LIMIT ?'
+        params.append(limit + 1)
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if before_id is not None:
+            rows.reverse()
+        return rows, has_more
+
+    def get_active_products_page(self, after_id=None, before_id=None, limit=10):
+        return self._products_page(
+            'id, name, price, quantity', 'active = TRUE AND quantity > 0',
+            after_id, before_id, limit
+        )
+
+    def get_products_page(self, after_id=None, before_id=None, limit=10):
+        return self._products_page('id, name, price, active', '1 = 1', after_id, before_id, limit)
+
+    def get_product_detail(self, product_id, user_id=None):
+        """The quantity is what ``user_id`` can still buy: stock minus other users' holds."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT name, description, price, quantity - {OTHERS_HOLDS_SQL} FROM products
+                WHERE id = ? AND active = TRUE
+            ''', (user_id, time.time(), product_id))
+            return cursor.fetchone()
+
+    def get_product_name_price(self, product_id):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT name, price FROM products WHERE id = ?', (product_id,))
+            return cursor.fetchone()
+
+    def get_product_for_edit(self, product_id):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT name, price, description, quantity, coordinates, active FROM products WHERE id = ?', (product_id,))
+            return cursor.fetchone()
+
+    def add_product(self, cursor, name, price, description, quantity, image1=None, image2=None, coordinates=None):
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                price REAL NOT NULL,
-                description TEXT,
-                quantity INTEGER NOT NULL,
-                image1 TEXT,
-                image2 TEXT,
-                coordinates TEXT,
-                active BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Content table
+            INSERT INTO products (name, price, description, quantity, image1, image2, coordinates, active)
+            VALUES (?, ?, ?, ?, ?, ?, ?, TRUE)
+        ''', (name, price, description, quantity, image1, image2, coordinates))
+        return cursor.lastrowid
+
+    def delete_product(self, cursor, product_id):
+        cursor.execute('DELETE FROM products WHERE id = ?', (product_id,))
+
+    PRODUCT_EDITABLE_COLUMNS = ('name', 'price', 'description', 'quantity', 'coordinates', 'image1', 'image2')
+
+    def update_product_field(self, cursor, product_id, field, value):
+        if field not in self.PRODUCT_EDITABLE_COLUMNS:
+            raise ValueError(f"Product field {field!r} can't be edited")
+        cursor.execute(f'UPDATE products SET {field} = ? WHERE id = ?', (value, product_id))
+        return cursor.rowcount > 0
+
+    def toggle_product_active(self, cursor, product_id):
+        """Flips the active flag and returns the new value, or None if the product doesn't exist."""
+        cursor.execute('UPDATE products SET active = NOT active WHERE id = ?', (product_id,))
+        if cursor.rowcount == 0:
+            return None
+        cursor.execute('SELECT active FROM products WHERE id = ?', (product_id,))
+        return bool(cursor.fetchone()[0])
+
+    # CART QUERIES
+    def _available_for(self, cursor, user_id, product_id, now):
+        cursor.execute(f'''
+            SELECT name, quantity - {OTHERS_HOLDS_SQL} FROM products
+            WHERE id = ? AND active = TRUE
+        ''', (user_id, now, product_id))
+        return cursor.fetchone()
+
+    def _set_hold(self, cursor, user_id, product_id, quantity, now):
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS content (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                key TEXT UNIQUE NOT NULL,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Payment settings table
+            INSERT INTO stock_holds (user_id, product_id, quantity, expires_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, product_id) DO UPDATE SET quantity = excluded.quantity, expires_at = excluded.expires_at
+        ''', (user_id, product_id, quantity, now + self.hold_ttl))
+
+    def _hold_line(self, cursor, user_id, product_id, quantity, minimum, now):
+        """Sets the user's hold to ``quantity`` capped at what is available, in one statement.
+
+        Nothing is written unless at least ``minimum`` pieces are available.
+        Returns ``(held quantity, name)`` or None.
+        """
+        # The stock ceiling is part of the SELECT, so an insert or update that
+        # would exceed it matches no row and nothing is returned
+        cursor.execute(f'''
+            INSERT INTO stock_holds (user_id, product_id, quantity, expires_at)
+            SELECT ?, id, MIN(?, quantity - {OTHERS_HOLDS_SQL}), ? FROM products
+            WHERE id = ? AND active = TRUE AND quantity - {OTHERS_HOLDS_SQL} >= ?
+            ON CONFLICT(user_id, product_id) DO UPDATE SET quantity = excluded.quantity, expires_at = excluded.expires_at
+            RETURNING quantity, (SELECT name FROM products WHERE id = stock_holds.product_id)
+        ''', (user_id, quantity, user_id, now, now + self.hold_ttl, product_id, user_id, now, minimum))
+        return cursor.fetchone()
+
+    def get_cart_lines(self, user_id):
+        """The user's cart as ``{product_id: quantity}``, without product data."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT product_id, quantity FROM cart WHERE user_id = ?', (user_id,))
+            return dict(cursor.fetchall())
+
+    def get_cart_products(self, product_ids):
+        """Returns ``{product_id: (name, price, active)}`` for the given products."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            placeholders = ','.join('?' * len(product_ids))
+            cursor.execute(f'''
+                SELECT id, name, price, active FROM products WHERE id IN ({placeholders})
+            ''', list(product_ids))
+            return {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+
+    def replace_carts(self, cursor, carts):
+        """Writes whole carts from a ``{user_id: {product_id: quantity}}`` dict."""
+        cursor.executemany('DELETE FROM cart WHERE user_id = ?', [(user_id,) for user_id in carts])
+        cursor.executemany(
+            'INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)',
+            [
+                (user_id, product_id, quantity)
+                for user_id, lines in carts.items()
+                for product_id, quantity in lines.items()
+            ]
+        )
+
+    def delete_idle_carts(self, cursor, max_idle_days, limit=200):
+        """Deletes up to ``limit`` carts untouched for more than ``max_idle_days``.
+
+        A cart is idle when none of its lines changed since the cutoff. What
+        the carts held is added to ``abandoned_cart_stats`` first. Returns
+        the user ids whose carts were deleted.
+        """
+        cutoff = f'-{max_idle_days} days'
+        # Old lines are found with a range scan of idx_cart_added, oldest
+        # first; each candidate user's own lines are then checked for a
+        # recent one through the (user_id, product_id) key
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS payment_settings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                currency_code TEXT UNIQUE NOT NULL,
-                address TEXT NOT NULL,
-                blockchain TEXT NOT NULL
+            SELECT DISTINCT user_id FROM (
+                SELECT idle.user_id FROM cart AS idle
+                WHERE idle.added_at < datetime('now', ?)
+                AND NOT EXISTS (
+                    SELECT 1 FROM cart AS recent
+                    WHERE recent.user_id = idle.user_id AND recent.added_at >= datetime('now', ?)
+                )
+                ORDER BY idle.added_at
             )
-        ''')
-        
-        # Discount codes table
+            LIMIT ?
+        ''', (cutoff, cutoff, limit))
+        user_ids = [row[0] for row in cursor.fetchall()]
+        if not user_ids:
+            return []
+
+        placeholders = ','.join('?' * len(user_ids))
+        cursor.execute(f'''
+            INSERT INTO abandoned_cart_stats (product_id, carts, quantity, last_abandoned_at)
+            SELECT product_id, COUNT(*), SUM(quantity), CURRENT_TIMESTAMP FROM cart
+            WHERE user_id IN ({placeholders})
+            GROUP BY product_id
+            ON CONFLICT(product_id) DO UPDATE SET
+                carts = carts + excluded.carts,
+                quantity = quantity + excluded.quantity,
+                last_abandoned_at = excluded.last_abandoned_at
+        ''', user_ids)
+        cursor.execute(f'DELETE FROM cart WHERE user_id IN ({placeholders})', user_ids)
+        return user_ids
+
+    def clear_cart(self, cursor, user_id):
+        cursor.execute('DELETE FROM cart WHERE user_id = ?', (user_id,))
+        cursor.execute('DELETE FROM stock_holds WHERE user_id = ?', (user_id,))
+
+    # STOCK HOLDS
+    def hold_stock(self, cursor, user_id, product_id, quantity):
+        """Makes sure the user holds at least ``quantity`` pieces of the product.
+
+        Returns a ``(status, name)`` tuple like ``hold_cart_line``.
+        """
+        now = time.time()
+        product = self._available_for(cursor, user_id, product_id, now)
+        if not product:
+            return 'not_found', None
+
+        name, available_quantity = product
+        if quantity > available_quantity:
+            return 'insufficient', name
+
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS discount_codes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                code TEXT UNIQUE NOT NULL,
-                discount_percentage REAL NOT NULL,
-                expiry_date DATE,
-                max_uses INTEGER DEFAULT -1,
-                used_count INTEGER DEFAULT 0,
-                is_general BOOLEAN DEFAULT TRUE,
-                client_id INTEGER,
-                client_username TEXT,
-                active BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Orders table
+            SELECT quantity FROM stock_holds WHERE user_id = ? AND product_id = ? AND expires_at > ?
+        ''', (user_id, product_id, now))
+        held = cursor.fetchone()
+        self._set_hold(cursor, user_id, product_id, max(quantity, held[0] if held else 0), now)
+        return 'held', name
+
+    def hold_cart_line(self, cursor, user_id, product_id, quantity):
+        """Sets the user's hold on a product to exactly ``quantity`` pieces if available.
+
+        Returns a ``(status, name)`` tuple where status is ``'held'``,
+        ``'not_found'`` or ``'insufficient'``. Stock held by other users
+        doesn't count as available.
+        """
+        now = time.time()
+        row = self._hold_line(cursor, user_id, product_id, quantity, quantity, now)
+        if row:
+            return 'held', row[1]
+
+        # Only the failure path pays for a second query, to tell why
+        product = self._available_for(cursor, user_id, product_id, now)
+        if not product:
+            return 'not_found', None
+        return 'insufficient', product[0]
+
+    def hold_cart_lines(self, cursor, user_id, quantities):
+        """Sets several holds at once from a ``{product_id: quantity}`` dict.
+
+        A quantity of 0 or less releases the hold. Quantities above what is
+        available are capped at it, and products that are gone or sold out
+        are skipped. Returns ``{product_id: quantity}`` for the holds set.
+        """
+        now = time.time()
+        self.release_holds(cursor, user_id, [product_id for product_id, quantity in quantities.items() if quantity <= 0])
+        held = {}
+        for product_id, quantity in quantities.items():
+            if quantity > 0:
+                row = self._hold_line(cursor, user_id, product_id, quantity, 1, now)
+                if row:
+                    held[product_id] = row[0]
+        return held
+
+    def release_holds(self, cursor, user_id, product_ids):
+        cursor.executemany(
+            'DELETE FROM stock_holds WHERE user_id = ? AND product_id = ?',
+            [(user_id, product_id) for product_id in product_ids]
+        )
+
+    def refresh_holds(self, cursor, user_id):
+        """Restarts the TTL of the user's unexpired holds, e.g. when checkout begins."""
+        now = time.time()
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                user_name TEXT,
-                product_id INTEGER,
-                product_name TEXT,
-                quantity INTEGER NOT NULL,
-                total_price REAL NOT NULL,
-                order_id TEXT UNIQUE NOT NULL,
-                payment_currency TEXT,
-                payment_source_address TEXT,
-                discount_code TEXT,
-                status TEXT DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Cart table
+            UPDATE stock_holds SET expires_at = ? WHERE user_id = ? AND expires_at > ?
+        ''', (now + self.hold_ttl, user_id, now))
+
+    def release_expired_holds(self, cursor, limit=500):
+        """Deletes up to ``limit`` expired holds and returns how many were deleted."""
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS cart (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                product_id INTEGER NOT NULL,
-                quantity INTEGER NOT NULL,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, product_id)
+            DELETE FROM stock_holds WHERE rowid IN (
+                SELECT rowid FROM stock_holds WHERE expires_at <= ? LIMIT ?
             )
-        ''')
-        
-        # Insert default content
-        default_content = [
-            ('welcome_message', 'Hello! 👋 I am your store bot.\n\nChoose from the options below:'),
-            ('about_us', 'This is our store. We sell quality products with crypto payments.'),
-            ('contact', 'Contact us: @admin'),
-            ('website', 'https://example.com'),
-            ('rules', 'Store rules:\n1. Be respectful\n2. No refunds'),
-            ('faq', 'Frequently Asked Questions:\nQ: How to pay?\nA: Use crypto payments.'),
-            ('success_message', 'Thank you for your purchase! Admin will contact you soon.')
+        ''', (time.time(), limit))
+        return cursor.rowcount
+
+    # CONTENT AND PAYMENT SETTINGS
+    def get_reference_data(self):
+        """Loads the whole content and payment_settings tables in one go."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT key, value FROM content')
+            content = cursor.fetchall()
+            cursor.execute('SELECT currency_code, address, blockchain FROM payment_settings ORDER BY id')
+            payment_methods = cursor.fetchall()
+            return content, payment_methods
+
+    def update_content(self, cursor, key, value):
+        cursor.execute('''
+            INSERT INTO content (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+        ''', (key, value))
+
+    def upsert_payment_method(self, cursor, currency, address, blockchain):
+        cursor.execute('''
+            INSERT INTO payment_settings (currency_code, address, blockchain) VALUES (?, ?, ?)
+            ON CONFLICT(currency_code) DO UPDATE SET address = excluded.address, blockchain = excluded.blockchain
+        ''', (currency, address, blockchain))
+
+    def delete_payment_method(self, cursor, currency):
+        cursor.execute('DELETE FROM payment_settings WHERE currency_code = ?', (currency,))
+        return cursor.rowcount > 0
+
+    # DISCOUNT CODES
+    def get_discount_code(self, code):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT discount_percentage, expiry_date, max_uses, used_count, is_general, client_id, client_username, active
+                FROM discount_codes 
+                WHERE code = ? AND active = TRUE
+            ''', (code,))
+            return cursor.fetchone()
+
+    # ORDERS
+    def create_order(self, cursor, order_id, user_id, user_name, items, total, currency, payment_source, discount_code=None, clear_cart=False, user_label=None):
+        """Places the order as one unit.
+
+        Stock is only taken when enough is left for every line and the
+        discount code is redeemed in the same step; if either fails, nothing
+        is written. Returns a dict with ``status`` (``'placed'``, ``'empty'``,
+        ``'insufficient_stock'`` or ``'discount_unavailable'``) and
+        ``order_id``. A stock failure also has ``short``, a list of
+        ``(name, requested, available)`` for the lines that can't be filled.
+        """
+        # A stale or repeated checkout has no items left; never place an empty order
+        if not items:
+            return {'status': 'empty', 'order_id': order_id}
+
+        # Parameters are built before any statement so the write lock is held briefly
+        now = time.time()
+        decrements = [(item['quantity'], item['product_id'], user_id, now, item['quantity']) for item in items]
+        consumed = [(item['quantity'], user_id, item['product_id']) for item in items]
+        total_cents = to_cents(total)
+        lines = [
+            (order_id, line, item['product_id'], item['name'], item['quantity'], to_cents(item['price']))
+            for line, item in enumerate(items, 1)
         ]
-        
-        cursor.executemany(
-            'INSERT OR IGNORE INTO content (key, value) VALUES (?, ?)',
-            default_content
-        )
-        
-        # Insert default payment methods
-        default_payments = [
-            ('btc', '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa', 'Bitcoin'),
-            ('eth', '0x742d35Cc6634C0532925a3b8D4B3b8a3b8d4b3b8', 'Ethereum'),
-            ('sol', 'So1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa', 'Solana'),
-            ('ltc', 'Lc1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa', 'Litecoin'),
-            ('usdt', '0x842d35Cc6634C0532925a3b8D4B3b8a3b8d4b3b8', 'Ethereum')
+        today = datetime.now().strftime('%Y-%m-%d')
+
+        cursor.execute('SAVEPOINT place_order')
+        try:
+            # A line without enough stock matches no row and the whole order is
+            # undone. Stock other users hold is off limits.
+            cursor.executemany(f'''
+                UPDATE products SET quantity = quantity - ?
+                WHERE id = ? AND quantity - {OTHERS_HOLDS_SQL} >= ?
+            ''', decrements)
+            if cursor.rowcount != len(decrements):
+                cursor.execute('ROLLBACK TO place_order')
+                return {'status': 'insufficient_stock', 'order_id': order_id, 'short': self._short_lines(cursor, user_id, items)}
+
+            if discount_code:
+                cursor.execute('''
+                    UPDATE discount_codes SET used_count = used_count + 1
+                    WHERE code = ? AND active = TRUE
+                    AND (max_uses = -1 OR used_count < max_uses)
+                    AND (expiry_date IS NULL OR expiry_date >= ?)
+                ''', (discount_code, today))
+                if cursor.rowcount == 0:
+                    cursor.execute('ROLLBACK TO place_order')
+                    return {'status': 'discount_unavailable', 'order_id': order_id}
+
+            cursor.execute('''
+                INSERT INTO orders
+                (order_id, user_id, user_name, total_cents, payment_currency, payment_source_address, discount_code)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (order_id, user_id, user_name, total_cents, currency, payment_source, discount_code))
+            cursor.executemany('''
+                INSERT INTO order_items (order_id, line, product_id, product_name, quantity, unit_price_cents)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', lines)
+
+            if clear_cart:
+                cursor.execute('DELETE FROM cart WHERE user_id = ?', (user_id,))
+
+            # The bought pieces are no longer held, they left the stock
+            cursor.executemany('''
+                UPDATE stock_holds SET quantity = quantity - ? WHERE user_id = ? AND product_id = ?
+            ''', consumed)
+            cursor.execute('DELETE FROM stock_holds WHERE user_id = ? AND quantity <= 0', (user_id,))
+
+            self.enqueue_notification(cursor, f"payment_pending:{order_id}", 'payment_pending', {
+                'order_id': order_id,
+                'user_id': user_id,
+                'client': user_label or user_name,
+                'product_name': items[0]['name'],
+                'total': total_cents / 100,
+                'currency': currency,
+                'payment_source': payment_source,
+                'discount_code': discount_code,
+                'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            })
+        except Exception:
+            cursor.execute('ROLLBACK TO place_order')
+            raise
+        finally:
+            cursor.execute('RELEASE place_order')
+
+        return {'status': 'placed', 'order_id': order_id}
+
+    def _short_lines(self, cursor, user_id, items):
+        product_ids = [item['product_id'] for item in items]
+        placeholders = ','.join('?' * len(product_ids))
+        cursor.execute(f'''
+            SELECT id, quantity - {OTHERS_HOLDS_SQL} FROM products WHERE id IN ({placeholders})
+        ''', [user_id, time.time(), *product_ids])
+        available = dict(cursor.fetchall())
+        return [
+            (item['name'], item['quantity'], available.get(item['product_id'], 0))
+            for item in items
+            if available.get(item['product_id'], 0) < item['quantity']
         ]
-        
-        cursor.executemany(
-            'INSERT OR IGNORE INTO payment_settings (currency_code, address, blockchain) VALUES (?, ?, ?)',
-            default_payments
-        )
-        
-        conn.commit()
-        conn.close()
 
-    def get_connection(self):
-        return sqlite3.connect(self.db_path)
+    def get_order_summary(self, order_id):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT o.user_id, o.user_name,
+                       (SELECT product_name FROM order_items WHERE order_id = o.order_id ORDER BY line LIMIT 1),
+                       o.total_cents / 100.0, o.payment_currency, o.payment_source_address, o.discount_code
+                FROM orders o
+                WHERE o.order_id = ?
+            ''', (order_id,))
+            return cursor.fetchone()
+
+    def complete_order(self, cursor, order_id):
+        """Marks a pending order completed and returns what has to be delivered.
+
+        Each row is ``(user_id, product_name, quantity, image1, image2, coordinates)``.
+        Returns None if the order isn't pending anymore.
+        """
+        # An expired or rejected order already gave its stock back
+        cursor.execute("UPDATE orders SET status = 'completed' WHERE order_id = ? AND status = 'pending'", (order_id,))
+        if cursor.rowcount == 0:
+            return None
+
+        cursor.execute('''
+            SELECT o.user_id, i.product_name, i.quantity, p.image1, p.image2, p.coordinates
+            FROM orders o
+            JOIN order_items i ON i.order_id = o.order_id
+            JOIN products p ON i.product_id = p.id
+            WHERE o.order_id = ?
+            ORDER BY i.line
+        ''', (order_id,))
+        deliveries = cursor.fetchall()
+        if deliveries:
+            self.enqueue_notification(cursor, f"order_completed:{order_id}", 'order_completed', {
+                'order_id': order_id,
+                'deliveries': [list(row) for row in deliveries]
+            })
+        return deliveries
+
+    def _restore_stock(self, cursor, order_ids):
+        """Puts the items of the given orders back into stock."""
+        cursor.executemany('''
+            UPDATE products SET quantity = quantity + (
+                SELECT SUM(i.quantity) FROM order_items i
+                WHERE i.order_id = ? AND i.product_id = products.id
+            )
+            WHERE id IN (SELECT product_id FROM order_items WHERE order_id = ?)
+        ''', [(order_id, order_id) for order_id in order_ids])
+
+    def reject_order(self, cursor, order_id):
+        """Marks a pending order rejected, returns its stock and returns the customer's user id.
+
+        Returns None if the order isn't pending anymore.
+        """
+        cursor.execute('''
+            UPDATE orders SET status = 'rejected' WHERE order_id = ? AND status = 'pending' RETURNING user_id
+        ''', (order_id,))
+        order = cursor.fetchone()
+        if not order:
+            return None
+
+        self._restore_stock(cursor, [order_id])
+        self.enqueue_notification(cursor, f"order_rejected:{order_id}", 'order_rejected', {
+            'order_id': order_id,
+            'user_id': order[0]
+        })
+        return order[0]
+
+    def expire_pending_orders(self, cursor, max_age_hours, limit=200):
+        """Expires up to ``limit`` orders left pending for longer than ``max_age_hours``.
+
+        Their stock goes back and each customer gets an ``order_expired``
+        notification. Returns how many orders expired.
+        """
+        cursor.execute('''
+            UPDATE orders SET status = 'expired'
+            WHERE id IN (
+                SELECT id FROM orders
+                WHERE status = 'pending' AND created_at < datetime('now', ?)
+                LIMIT ?
+            )
+            RETURNING order_id, user_id
+        ''', (f'-{max_age_hours} hours', limit))
+        expired = cursor.fetchall()
+
+        self._restore_stock(cursor, [order_id for order_id, _ in expired])
+        for order_id, user_id in expired:
+            self.enqueue_notification(cursor, f"order_expired:{order_id}", 'order_expired', {
+                'order_id': order_id,
+                'user_id': user_id
+            })
+        return len(expired)
+
+    def archive_orders(self, cursor, max_age_days, limit=200):
+        """Moves up to ``limit`` finished orders older than ``max_age_days`` to the archive.
+
+        Returns how many orders were moved.
+        """
+        placeholders = ','.join('?' * len(FINISHED_ORDER_STATUSES))
+        cursor.execute(f'''
+            SELECT order_id FROM orders
+            WHERE status IN ({placeholders}) AND created_at < datetime('now', ?)
+            LIMIT ?
+        ''', (*FINISHED_ORDER_STATUSES, f'-{max_age_days} days', limit))
+        order_ids = cursor.fetchall()
+
+        cursor.executemany('''
+            INSERT INTO orders_archive
+            (id, order_id, user_id, user_name, total_cents, payment_currency, payment_source_address, discount_code, status, created_at)
+            SELECT id, order_id, user_id, user_name, total_cents, payment_currency, payment_source_address, discount_code, status, created_at
+            FROM orders WHERE order_id = ?
+        ''', order_ids)
+        cursor.executemany('''
+            INSERT INTO order_items_archive (order_id, line, product_id, product_name, quantity, unit_price_cents)
+            SELECT order_id, line, product_id, product_name, quantity, unit_price_cents
+            FROM order_items WHERE order_id = ?
+        ''', order_ids)
+        cursor.executemany('DELETE FROM order_items WHERE order_id = ?', order_ids)
+        cursor.executemany('DELETE FROM orders WHERE order_id = ?', order_ids)
+        return len(order_ids)
+
+    def incremental_vacuum(self, cursor, pages):
+        """Returns up to ``pages`` free pages to the filesystem, returns how many."""
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] != 2:
+            # Not converted yet, incremental_vacuum does nothing
+            return 0
+        cursor.execute('PRAGMA freelist_count')
+        pages = min(pages, cursor.fetchone()[0])
+        # A single incremental_vacuum(N) is only stepped once through the
+        # sqlite3 module and frees one page, so run it once per page
+        cursor.executemany('PRAGMA incremental_vacuum(1)', [()] * pages)
+        return pages
+
+    # OUTBOX
+    def enqueue_notification(self, cursor, event_key, kind, payload):
+        """Adds a notification to the outbox; an event already there is not added twice."""
+        cursor.execute('''
+            INSERT OR IGNORE INTO outbox (event_key, kind, payload) VALUES (?, ?, ?)
+        ''', (event_key, kind, json.dumps(payload)))
+
+    def get_due_notifications(self, limit=50):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, kind, payload, attempts, delivered FROM outbox
+                WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                ORDER BY id
+                LIMIT ?
+            ''', (limit,))
+            return [
+                (row[0], row[1], json.loads(row[2]), row[3], json.loads(row[4]) if row[4] else [])
+                for row in cursor.fetchall()
+            ]
+
+    def mark_notifications(self, cursor, sent_ids, failures):
+        """Records a dispatch round.
+
+        ``failures`` holds ``(id, error, retry_in, delivered)`` tuples;
+        ``retry_in`` is the delay in seconds, or None when the notification
+        is given up on, and ``delivered`` lists the parts already sent.
+        """
+        cursor.executemany('''
+            UPDATE outbox SET status = 'sent', attempts = attempts + 1, sent_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', [(notification_id,) for notification_id in sent_ids])
+
+        cursor.executemany('''
+            UPDATE outbox SET
+                status = CASE WHEN ? IS NULL THEN 'failed' ELSE 'pending' END,
+                attempts = attempts + 1,
+                last_error = ?,
+                next_attempt_at = datetime('now', '+' || COALESCE(?, 0) || ' seconds'),
+                delivered = ?
+            WHERE id = ?
+        ''', [
+            (retry_in, error, retry_in, json.dumps(sorted(delivered)) if delivered else None, notification_id)
+            for notification_id, error, retry_in, delivered in failures
+        ])
+
+    # STATISTICS
+    def get_statistics(self):
+        """Dashboard figures, read from the trigger-maintained stats counters.
+
+        Order figures include archived orders.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT name, value FROM stats_counters')
+            counters = dict(cursor.fetchall())
+            return {
+                'total_products': counters.get('products', 0),
+                'active_products': counters.get('products.active', 0),
+                'total_orders': counters.get('orders', 0) + counters.get('orders_archive', 0),
+                'completed_orders': counters.get('orders.completed', 0) + counters.get('orders_archive.completed', 0),
+                'pending_orders': counters.get('orders.pending', 0),
+                'products_in_carts': counters.get('cart', 0),
+                'total_codes': counters.get('discount_codes', 0),
+                'active_codes': counters.get('discount_codes.active', 0),
+            }
 
 # Create global database instance
-db = Database()
+db = Database(
+    pool_size=int(os.getenv('DB_POOL_SIZE', 5)),
+    hold_ttl=int(os.getenv('STOCK_HOLD_TTL', 900)),
+    convert_auto_vacuum=os.getenv('AUTO_VACUUM_CONVERT', '0') == '1'
+)
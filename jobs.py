@@ -0,0 +1,97 @@
+import os
+import logging
+
+from async_db import adb
+from backup import backup_manager
+from outbox import outbox
+from cart_store import cart_store
+
+logger = logging.getLogger(__name__)
+
+# Expired stock holds deleted per write, so the sweeper never holds the write lock for long
+HOLD_SWEEP_BATCH = int(os.getenv('STOCK_HOLD_SWEEP_BATCH', 500))
+
+# Orders still pending after this many hours expire and give their stock back
+PENDING_ORDER_TTL_HOURS = float(os.getenv('PENDING_ORDER_TTL_HOURS', 24))
+ORDER_EXPIRY_BATCH = int(os.getenv('ORDER_EXPIRY_BATCH', 200))
+
+# Carts nobody touched for this many days are deleted
+CART_IDLE_DAYS = float(os.getenv('CART_IDLE_DAYS', 7))
+CART_CLEANUP_BATCH = int(os.getenv('CART_CLEANUP_BATCH', 200))
+
+# Finished orders older than this many days are archived
+ORDER_ARCHIVE_AGE_DAYS = int(os.getenv('ORDER_ARCHIVE_AGE_DAYS', 30))
+ORDER_ARCHIVE_BATCH = int(os.getenv('ORDER_ARCHIVE_BATCH', 200))
+
+# Free pages handed back to the filesystem after each archive run
+VACUUM_PAGES = int(os.getenv('VACUUM_PAGES', 2000))
+
+
+async def release_expired_holds(context):
+    """Job queue callback that deletes expired stock holds in batches.
+
+    Expired holds already stop counting against availability, this only
+    keeps the table small.
+    """
+    released = 0
+    while True:
+        count = await adb.release_expired_holds(HOLD_SWEEP_BATCH)
+        released += count
+        if count < HOLD_SWEEP_BATCH:
+            break
+    if released:
+        logger.info("Released %d expired stock holds", released)
+
+
+async def archive_orders(context):
+    """Job queue callback that moves old finished orders to the archive tables.
+
+    Each batch is its own short write, and the pages the batches freed are
+    reclaimed with a bounded incremental vacuum afterwards.
+    """
+    archived = 0
+    while True:
+        count = await adb.archive_orders(ORDER_ARCHIVE_AGE_DAYS, ORDER_ARCHIVE_BATCH)
+        archived += count
+        if count < ORDER_ARCHIVE_BATCH:
+            break
+    freed = await adb.incremental_vacuum(VACUUM_PAGES)
+    if archived or freed:
+        logger.info("Archived %d orders, freed %d pages", archived, freed)
+
+
+async def backup_database(context):
+    """Job queue callback that takes a database snapshot, see backup.BackupManager."""
+    await backup_manager.run()
+
+
+async def expire_pending_orders(context):
+    """Job queue callback that expires orders whose payment was never confirmed.
+
+    One sweep is one write transaction of at most ``ORDER_EXPIRY_BATCH``
+    orders; anything left over is picked up by the next sweep. Customers
+    are told through the outbox, which sends via the rate-limited queue.
+    """
+    expired = await adb.expire_pending_orders(PENDING_ORDER_TTL_HOURS, ORDER_EXPIRY_BATCH)
+    if expired:
+        logger.info("Expired %d unpaid orders", expired)
+        outbox.kick(context.job_queue)
+
+
+async def clean_abandoned_carts(context):
+    """Job queue callback that deletes idle carts in batches.
+
+    Pending in-memory changes are flushed first, so a cart in use never
+    looks idle. What each batch held is rolled up into
+    ``abandoned_cart_stats`` in the same write.
+    """
+    await cart_store.flush()
+    deleted = 0
+    while True:
+        user_ids = await adb.delete_idle_carts(CART_IDLE_DAYS, CART_CLEANUP_BATCH)
+        cart_store.forget_idle(user_ids)
+        deleted += len(user_ids)
+        if len(user_ids) < CART_CLEANUP_BATCH:
+            break
+    if deleted:
+        logger.info("Deleted %d abandoned carts", deleted)
@@ -0,0 +1,540 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Each migration is (version, description, step). Steps receive a cursor and
+# run inside a single transaction together with the schema_version bump.
+# Never edit a released step; append a new one instead.
+
+
+def _initial_schema(cursor):
+    # Products table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            price REAL NOT NULL,
+            description TEXT,
+            quantity INTEGER NOT NULL,
+            image1 TEXT,
+            image2 TEXT,
+            coordinates TEXT,
+            active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Content table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS content (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key TEXT UNIQUE NOT NULL,
+            value TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Payment settings table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payment_settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            currency_code TEXT UNIQUE NOT NULL,
+            address TEXT NOT NULL,
+            blockchain TEXT NOT NULL
+        )
+    ''')
+
+    # Discount codes table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS discount_codes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT UNIQUE NOT NULL,
+            discount_percentage REAL NOT NULL,
+            expiry_date DATE,
+            max_uses INTEGER DEFAULT -1,
+            used_count INTEGER DEFAULT 0,
+            is_general BOOLEAN DEFAULT TRUE,
+            client_id INTEGER,
+            client_username TEXT,
+            active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Orders table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            user_name TEXT,
+            product_id INTEGER,
+            product_name TEXT,
+            quantity INTEGER NOT NULL,
+            total_price REAL NOT NULL,
+            order_id TEXT UNIQUE NOT NULL,
+            payment_currency TEXT,
+            payment_source_address TEXT,
+            discount_code TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Cart table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cart (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, product_id)
+        )
+    ''')
+
+    # Insert default content
+    default_content = [
+        ('welcome_message', 'Hello! 👋 I am your store bot.\n\nChoose from the options below:'),
+        ('about_us', 'This is our store. We sell quality products with crypto payments.'),
+        ('contact', 'Contact us: @admin'),
+        ('website', 'https://example.com'),
+        ('rules', 'Store rules:\n1. Be respectful\n2. No refunds'),
+        ('faq', 'Frequently Asked Questions:\nQ: How to pay?\nA: Use crypto payments.'),
+        ('success_message', 'Thank you for your purchase! Admin will contact you soon.')
+    ]
+
+    cursor.executemany(
+        'INSERT OR IGNORE INTO content (key, value) VALUES (?, ?)',
+        default_content
+    )
+
+    # Insert default payment methods
+    default_payments = [
+        ('btc', '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa', 'Bitcoin'),
+        ('eth', '0x742d35Cc6634C0532925a3b8D4B3b8a3b8d4b3b8', 'Ethereum'),
+        ('sol', 'So1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa', 'Solana'),
+        ('ltc', 'Lc1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa', 'Litecoin'),
+        ('usdt', '0x842d35Cc6634C0532925a3b8D4B3b8a3b8d4b3b8', 'Ethereum')
+    ]
+
+    cursor.executemany(
+        'INSERT OR IGNORE INTO payment_settings (currency_code, address, blockchain) VALUES (?, ?, ?)',
+        default_payments
+    )
+
+
+def _hot_path_indexes(cursor):
+    # Catalog: equality on active, rows already ordered by name, quantity
+    # filtered and price read from the index (id is the rowid)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_products_catalog
+        ON products (active, name, quantity, price)
+    ''')
+
+    # Admin product list ordered by name
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_products_name
+        ON products (name, price, active)
+    ''')
+
+    # Per-customer order history
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_orders_user
+        ON orders (user_id, created_at)
+    ''')
+
+    # Status counts in statistics and pending-order scans by age
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_orders_status_created
+        ON orders (status, created_at)
+    ''')
+
+    # Order lines by product, used when products are deleted or delivered
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_orders_product
+        ON orders (product_id)
+    ''')
+
+    # Active discount code count in statistics
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_discount_codes_active
+        ON discount_codes (active)
+    ''')
+
+
+def _keyset_product_indexes(cursor):
+    # Paged browsing seeks on (name, id), so id has to follow name directly
+    cursor.execute('DROP INDEX IF EXISTS idx_products_catalog')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_products_catalog_keyset
+        ON products (active, name, id, quantity, price)
+    ''')
+
+    cursor.execute('DROP INDEX IF EXISTS idx_products_name')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_products_name_keyset
+        ON products (name, id, price, active)
+    ''')
+
+
+def _outbox(cursor):
+    # Notifications are written in the same transaction as the order change
+    # that causes them and delivered later by outbox.OutboxDispatcher
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_key TEXT UNIQUE NOT NULL,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_outbox_due
+        ON outbox (status, next_attempt_at)
+    ''')
+
+
+def _order_lines_share_order_id(cursor):
+    # A cart checkout stores one row per product under the same order_id,
+    # which the original UNIQUE constraint rejected. SQLite can't drop a
+    # constraint, so the table is rebuilt.
+    cursor.execute('''
+        CREATE TABLE orders_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            user_name TEXT,
+            product_id INTEGER,
+            product_name TEXT,
+            quantity INTEGER NOT NULL,
+            total_price REAL NOT NULL,
+            order_id TEXT NOT NULL,
+            payment_currency TEXT,
+            payment_source_address TEXT,
+            discount_code TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('INSERT INTO orders_new SELECT * FROM orders')
+    cursor.execute('DROP TABLE orders')
+    cursor.execute('ALTER TABLE orders_new RENAME TO orders')
+
+    cursor.execute('CREATE INDEX idx_orders_order_id ON orders (order_id)')
+    cursor.execute('CREATE INDEX idx_orders_user ON orders (user_id, created_at)')
+    cursor.execute('CREATE INDEX idx_orders_status_created ON orders (status, created_at)')
+    cursor.execute('CREATE INDEX idx_orders_product ON orders (product_id)')
+
+
+def _stock_holds(cursor):
+    # Stock reserved by carts and checkouts; expires_at is a unix timestamp and
+    # only rows that haven't expired count against availability
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_holds (
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (user_id, product_id)
+        )
+    ''')
+
+    # Availability sums a product's live holds straight from the index
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_stock_holds_product
+        ON stock_holds (product_id, expires_at, user_id, quantity)
+    ''')
+
+    # The sweeper finds expired holds by age
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_stock_holds_expiry
+        ON stock_holds (expires_at)
+    ''')
+
+
+# Row counts kept per table: (column, counter name expression). Besides the
+# table's own count, each row is counted under the name its column value
+# maps to, unless that name is NULL.
+STATS_COUNTERS = {
+    'products': ('active', "CASE WHEN {row}.active = TRUE THEN 'products.active' END"),
+    'orders': ('status', "'orders.' || {row}.status"),
+    'cart': (None, None),
+    'discount_codes': ('active', "CASE WHEN {row}.active = TRUE THEN 'discount_codes.active' END"),
+    'orders_archive': ('status', "'orders_archive.' || {row}.status"),
+}
+
+
+def _bump_counter(name_sql, delta):
+    return f'''
+        INSERT INTO stats_counters (name, value)
+        SELECT {name_sql}, {delta} WHERE {name_sql} IS NOT NULL
+        ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+    '''
+
+
+def _counter_triggers(cursor, table):
+    """(Re)creates the triggers that keep ``table``'s stats counters current."""
+    column, group = STATS_COUNTERS[table]
+
+    on_insert = _bump_counter(f"'{table}'", 1)
+    on_delete = _bump_counter(f"'{table}'", -1)
+    if group:
+        on_insert += _bump_counter(group.format(row='NEW'), 1)
+        on_delete += _bump_counter(group.format(row='OLD'), -1)
+
+    cursor.execute(f'DROP TRIGGER IF EXISTS trg_{table}_stats_insert')
+    cursor.execute(f'CREATE TRIGGER trg_{table}_stats_insert AFTER INSERT ON {table} BEGIN {on_insert} END')
+    cursor.execute(f'DROP TRIGGER IF EXISTS trg_{table}_stats_delete')
+    cursor.execute(f'CREATE TRIGGER trg_{table}_stats_delete AFTER DELETE ON {table} BEGIN {on_delete} END')
+
+    if group:
+        on_update = _bump_counter(group.format(row='OLD'), -1) + _bump_counter(group.format(row='NEW'), 1)
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_{table}_stats_update')
+        cursor.execute(f'''
+            CREATE TRIGGER trg_{table}_stats_update AFTER UPDATE OF {column} ON {table}
+            WHEN OLD.{column} IS NOT NEW.{column}
+            BEGIN {on_update} END
+        ''')
+
+
+def _backfill_counters(cursor, table):
+    """Sets ``table``'s stats counters from a full count of its rows."""
+    _, group = STATS_COUNTERS[table]
+    cursor.execute(f'''
+        INSERT OR REPLACE INTO stats_counters (name, value)
+        SELECT '{table}', COUNT(*) FROM {table}
+    ''')
+    if group:
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO stats_counters (name, value)
+            SELECT name, COUNT(*) FROM (SELECT {group.format(row=table)} AS name FROM {table})
+            WHERE name IS NOT NULL
+            GROUP BY name
+        ''')
+
+
+def _stats_counters(cursor):
+    # The admin dashboard reads these instead of counting whole tables;
+    # triggers keep them in step with every write, whichever code path
+    # makes it, and the backfill seeds them from the existing rows
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+
+    for table in ('products', 'orders', 'cart', 'discount_codes'):
+        _counter_triggers(cursor, table)
+        _backfill_counters(cursor, table)
+
+
+def _normalized_orders(cursor):
+    # One header row per order and one item row per product. Money is kept
+    # in integer cents. Old rows repeated the order total on every line, so
+    # a migrated line's unit price is the total split over a single-line
+    # order, or else the product's current price, or NULL if the product is gone.
+    cursor.execute('''
+        CREATE TABLE orders_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id TEXT UNIQUE NOT NULL,
+            user_id INTEGER NOT NULL,
+            user_name TEXT,
+            total_cents INTEGER NOT NULL,
+            payment_currency TEXT,
+            payment_source_address TEXT,
+            discount_code TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Items are clustered by order, so an order's lines are one range read
+    cursor.execute('''
+        CREATE TABLE order_items (
+            order_id TEXT NOT NULL REFERENCES orders_new (order_id),
+            line INTEGER NOT NULL,
+            product_id INTEGER,
+            product_name TEXT,
+            quantity INTEGER NOT NULL,
+            unit_price_cents INTEGER,
+            PRIMARY KEY (order_id, line)
+        ) WITHOUT ROWID
+    ''')
+
+    # The header takes the values of the order's first row
+    cursor.execute('''
+        INSERT INTO orders_new
+        (id, order_id, user_id, user_name, total_cents, payment_currency, payment_source_address, discount_code, status, created_at)
+        SELECT MIN(id), order_id, user_id, user_name, CAST(ROUND(total_price * 100) AS INTEGER),
+               payment_currency, payment_source_address, discount_code, status, created_at
+        FROM orders
+        GROUP BY order_id
+    ''')
+    cursor.execute('''
+        INSERT INTO order_items (order_id, line, product_id, product_name, quantity, unit_price_cents)
+        SELECT o.order_id,
+               ROW_NUMBER() OVER (PARTITION BY o.order_id ORDER BY o.id),
+               o.product_id, o.product_name, o.quantity,
+               CASE
+                   WHEN COUNT(*) OVER (PARTITION BY o.order_id) = 1
+                   THEN CAST(ROUND(o.total_price * 100 / o.quantity) AS INTEGER)
+                   ELSE CAST(ROUND(p.price * 100) AS INTEGER)
+               END
+        FROM orders o
+        LEFT JOIN products p ON p.id = o.product_id
+    ''')
+
+    cursor.execute('DROP TABLE orders')
+    cursor.execute('ALTER TABLE orders_new RENAME TO orders')
+
+    cursor.execute('CREATE INDEX idx_orders_user ON orders (user_id, created_at)')
+    cursor.execute('CREATE INDEX idx_orders_status_created ON orders (status, created_at)')
+    cursor.execute('CREATE INDEX idx_order_items_product ON order_items (product_id)')
+
+    # Dropping the old table dropped its triggers; orders now count once each
+    _counter_triggers(cursor, 'orders')
+    _backfill_counters(cursor, 'orders')
+
+
+def _order_archive(cursor):
+    # Finished orders past the retention age are moved here in batches by
+    # jobs.archive_orders, so the hot tables only hold recent orders. The
+    # archive keeps its own stats counters and the dashboard adds both up.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orders_archive (
+            id INTEGER PRIMARY KEY,
+            order_id TEXT UNIQUE NOT NULL,
+            user_id INTEGER NOT NULL,
+            user_name TEXT,
+            total_cents INTEGER NOT NULL,
+            payment_currency TEXT,
+            payment_source_address TEXT,
+            discount_code TEXT,
+            status TEXT,
+            created_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS order_items_archive (
+            order_id TEXT NOT NULL,
+            line INTEGER NOT NULL,
+            product_id INTEGER,
+            product_name TEXT,
+            quantity INTEGER NOT NULL,
+            unit_price_cents INTEGER,
+            PRIMARY KEY (order_id, line)
+        ) WITHOUT ROWID
+    ''')
+
+    _counter_triggers(cursor, 'orders_archive')
+    _backfill_counters(cursor, 'orders_archive')
+
+
+def _abandoned_carts(cursor):
+    # jobs.clean_abandoned_carts finds idle carts by age; user_id is included
+    # so the lookup never touches the table
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_cart_added
+        ON cart (added_at, user_id)
+    ''')
+
+    # What abandoned carts held, per product, added up before they are deleted
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS abandoned_cart_stats (
+            product_id INTEGER PRIMARY KEY,
+            carts INTEGER NOT NULL DEFAULT 0,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            last_abandoned_at TIMESTAMP
+        )
+    ''')
+
+
+def _outbox_delivered_parts(cursor):
+    # A notification sent as several Telegram messages remembers which of
+    # them went out, so a retry only sends the rest
+    cursor.execute('ALTER TABLE outbox ADD COLUMN delivered TEXT')
+
+
+MIGRATIONS = [
+    (1, 'initial schema', _initial_schema),
+    (2, 'hot path indexes', _hot_path_indexes),
+    (3, 'keyset product indexes', _keyset_product_indexes),
+    (4, 'notification outbox', _outbox),
+    (5, 'order lines share order id', _order_lines_share_order_id),
+    (6, 'stock holds', _stock_holds),
+    (7, 'stats counters', _stats_counters),
+    (8, 'normalized orders', _normalized_orders),
+    (9, 'order archive', _order_archive),
+    (10, 'abandoned carts', _abandoned_carts),
+    (11, 'outbox delivered parts', _outbox_delivered_parts),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    return cursor.fetchone()[0]
+
+
+def migrate(conn):
+    """Brings the database up to the latest schema version.
+
+    ``conn`` must be in autocommit mode (``isolation_level = None``). Every
+    pending step runs in its own ``BEGIN IMMEDIATE`` transaction, so a
+    database created before versioning (version 0) is upgraded in place.
+
+    The applied version is mirrored into ``PRAGMA user_version``, so a
+    current database is recognised with a single header read and no DDL.
+    """
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA user_version')
+    if cursor.fetchone()[0] >= LATEST_VERSION:
+        return LATEST_VERSION
+
+    current = get_schema_version(cursor)
+    applied = 0
+
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+
+        logger.info("Applying migration %d: %s", version, description)
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            step(cursor)
+            cursor.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+            cursor.execute(f'PRAGMA user_version = {version}')
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        applied += 1
+
+    if applied:
+        # Refresh planner statistics so the new indexes get picked up
+        cursor.execute('PRAGMA optimize')
+    else:
+        # Versioned before user_version was tracked
+        cursor.execute(f'PRAGMA user_version = {current}')
+
+    return current + applied
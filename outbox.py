@@ -0,0 +1,108 @@
+import os
+import asyncio
+import logging
+
+from telegram.error import BadRequest, Forbidden
+
+from async_db import adb
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxDispatcher:
+    """Delivers notifications stored in the ``outbox`` table.
+
+    Rows are written by the database in the same transaction as the order
+    change they announce, so a crash can't lose them. ``dispatch`` reads a
+    batch of due rows, runs the handler registered for each kind
+    concurrently and records the outcome of the whole batch in one write.
+    A failed row is retried with exponential backoff until
+    ``max_attempts``, then marked failed; ``BadRequest`` and ``Forbidden``
+    can't succeed on a retry and fail the row right away. Delivery is at
+    least once: a row is only marked sent after its handler finished, and
+    an event key can only be queued once. A notification made of several
+    messages is registered with ``parts``, so the messages already sent
+    are not sent again on retry.
+    """
+
+    def __init__(self, database, batch_size=50, max_attempts=8, max_backoff=3600):
+        self.database = database
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self._handlers = {}
+        self._lock = asyncio.Lock()
+        self._again = False
+
+    def register(self, kind, handler, parts=False):
+        """``handler(payload)`` is awaited for each notification of this kind.
+
+        With ``parts`` it is awaited as ``handler(payload, delivered)`` and
+        adds the key of every message it sent to the ``delivered`` set; a
+        retry passes the keys recorded so far.
+        """
+        self._handlers[kind] = (handler, parts)
+
+    async def run_job(self, context):
+        await self.dispatch()
+
+    def kick(self, job_queue):
+        """Dispatches right away instead of waiting for the next interval."""
+        job_queue.run_once(self.run_job, 0)
+
+    async def dispatch(self):
+        if self._lock.locked():
+            # A round is running, it goes again once it's done
+            self._again = True
+            return 0
+
+        delivered = 0
+        async with self._lock:
+            while True:
+                self._again = False
+                rows = await self.database.get_due_notifications(self.batch_size)
+                if rows:
+                    delivered += await self._dispatch_batch(rows)
+                if not self._again and len(rows) < self.batch_size:
+                    return delivered
+
+    async def _dispatch_batch(self, rows):
+        delivered = [set(parts) for *_, parts in rows]
+        results = await asyncio.gather(
+            *(self._deliver(kind, payload, done) for (_, kind, payload, _, _), done in zip(rows, delivered)),
+            return_exceptions=True
+        )
+
+        sent_ids = []
+        failures = []
+        for (notification_id, kind, _, attempts, _), done, result in zip(rows, delivered, results):
+            if not isinstance(result, Exception):
+                sent_ids.append(notification_id)
+                continue
+
+            attempts += 1
+            retry_in = None
+            if attempts < self.max_attempts and not isinstance(result, (BadRequest, Forbidden)):
+                retry_in = min(5 * 2 ** (attempts - 1), self.max_backoff)
+            logger.warning("Outbox notification %s (%s) failed on attempt %d: %s", notification_id, kind, attempts, result)
+            failures.append((notification_id, str(result), retry_in, done))
+
+        await self.database.mark_notifications(sent_ids, failures)
+        return len(sent_ids)
+
+    async def _deliver(self, kind, payload, delivered):
+        handler, parts = self._handlers.get(kind, (None, False))
+        if handler is None:
+            raise LookupError(f"No outbox handler for {kind!r}")
+        if parts:
+            await handler(payload, delivered)
+        else:
+            await handler(payload)
+
+
+# Create global outbox dispatcher instance
+outbox = OutboxDispatcher(
+    adb,
+    batch_size=int(os.getenv('OUTBOX_BATCH_SIZE', 50)),
+    max_attempts=int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+)
@@ -0,0 +1,137 @@
+import logging
+
+from callback_codec import CallbackCodec, CallbackDataError, MARKER
+
+logger = logging.getLogger(__name__)
+
+
+class Route:
+    def __init__(self, name, handler, arg_types=(), admin_only=False, answers=False):
+        self.name = name
+        self.handler = handler
+        self.arg_types = arg_types
+        self.admin_only = admin_only
+        # The handler answers the callback query itself (toasts, alerts)
+        self.answers = answers
+
+    def parse_args(self, raw):
+        """Converts the part of the data after the prefix into typed arguments.
+
+        The last argument takes whatever is left, so string arguments may
+        contain underscores. Returns None when the data doesn't fit.
+        """
+        if not self.arg_types:
+            return () if raw == '' else None
+        if raw == '':
+            return None
+
+        parts = raw.split('_', len(self.arg_types) - 1)
+        if len(parts) != len(self.arg_types):
+            return None
+        try:
+            return tuple(arg_type(part) for arg_type, part in zip(self.arg_types, parts))
+        except ValueError:
+            return None
+
+
+class CallbackRouter:
+    """Dispatches callback query data to handlers.
+
+    Fixed callbacks are looked up in a dict. Parameterized ones are stored
+    in a character trie keyed by their prefix; the longest registered prefix
+    whose arguments parse wins, so ``admin_confirm_yes_`` is preferred over
+    ``admin_confirm_`` no matter the registration order. Dispatch cost
+    depends on the length of the data, not on the number of routes.
+
+    Buttons for parameterized routes are built with ``data()``, which packs
+    the route and its arguments with a ``CallbackCodec``. The plain
+    ``<prefix><args>`` form is still resolved for buttons in old messages.
+    """
+
+    def __init__(self, is_admin, codec=None):
+        self.is_admin = is_admin
+        self.codec = codec or CallbackCodec()
+        self._exact = {}
+        self._trie = {}
+        self._by_name = {}
+
+    def exact(self, data, handler, admin_only=False, answers=False):
+        if data in self._exact:
+            raise ValueError(f"Duplicate route: {data}")
+        self._exact[data] = Route(data, handler, admin_only=admin_only, answers=answers)
+
+    def prefix(self, prefix, handler, *arg_types, admin_only=False, answers=False):
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        if None in node:
+            raise ValueError(f"Duplicate route prefix: {prefix}")
+        # The None key marks the end of a registered prefix
+        route = Route(prefix, handler, arg_types, admin_only=admin_only, answers=answers)
+        node[None] = route
+        self._by_name[prefix] = route
+        self.codec.register(prefix, arg_types)
+
+    def data(self, prefix, *args):
+        """Callback data for a button that triggers the given parameterized route."""
+        return self.codec.encode(prefix, *args)
+
+    def pattern(self, *names):
+        """Callback pattern for CallbackQueryHandler matching any of the named routes."""
+        names = set(names)
+
+        def matches(data):
+            match = self.resolve(data) if isinstance(data, str) else None
+            return match is not None and match[0].name in names
+
+        return matches
+
+    def resolve(self, data):
+        """Returns ``(route, args)`` for the data, or None when nothing matches."""
+        route = self._exact.get(data)
+        if route is not None:
+            return route, ()
+
+        if data.startswith(MARKER):
+            try:
+                name, args = self.codec.decode(data)
+            except CallbackDataError as e:
+                logger.debug("Rejected callback data %r: %s", data, e)
+                return None
+            return self._by_name[name], args
+
+        candidates = []
+        node = self._trie
+        for position, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                candidates.append((node[None], position + 1))
+
+        for route, end in reversed(candidates):
+            args = route.parse_args(data[end:])
+            if args is not None:
+                return route, args
+        return None
+
+    async def dispatch(self, update, context):
+        query = update.callback_query
+        data = query.data or ''
+
+        match = self.resolve(data)
+        if match is None:
+            logger.warning("Unrouted callback data %r from user %s", data, query.from_user.id)
+            await query.answer("This button is not available.", show_alert=True)
+            return
+
+        route, args = match
+        if route.admin_only and not self.is_admin(query.from_user.id):
+            logger.warning("User %s tried admin callback %r", query.from_user.id, data)
+            await query.answer("Access denied!", show_alert=True)
+            return
+
+        if not route.answers:
+            await query.answer()
+
+        return await route.handler(update, context, *args)
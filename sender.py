@@ -0,0 +1,247 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+
+from telegram.error import RetryAfter, NetworkError, TimedOut, Forbidden, BadRequest
+
+logger = logging.getLogger(__name__)
+
+# Lower value is sent first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # Set from RetryAfter, nothing is sent before this time
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until a token is available."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self):
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+    async def acquire(self):
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                self.take()
+                return
+            await asyncio.sleep(wait)
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle_delay(self):
+        """Seconds until the bucket is full again, after which its state can be dropped."""
+        now = time.monotonic()
+        self._refill(now)
+        return max((self.capacity - self.tokens) / self.rate, self.blocked_until - now)
+
+
+class _Chat:
+    def __init__(self, bucket):
+        self.bucket = bucket
+        # (priority, seq, job) heap, sent one at a time
+        self.jobs = []
+        # Scheduled on the ready queue or being sent
+        self.active = False
+
+
+class SendQueue:
+    """Outbound delivery engine for Bot API calls aimed at a chat.
+
+    Handlers call ``send_message``/``send_photo``/``send_media_group`` (or
+    ``enqueue`` for any other chat method) and get a future back right
+    away. Workers deliver the calls in priority order while respecting a
+    global token bucket and one bucket per chat. Each chat has at most one
+    call in flight, so its messages arrive in the order they were queued
+    (within the same priority). ``RetryAfter`` pauses only the chat it was
+    raised for; network errors are retried with exponential backoff. At
+    most ``max_concurrency`` calls run at once.
+    """
+
+    def __init__(self, global_rate=30, per_chat_rate=1, per_chat_burst=3, max_concurrency=8, max_retries=5):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.bot = None
+        self._chats = {}
+        self._ready = None
+        self._workers = []
+        self._seq = itertools.count()
+        self._pending = 0
+        self._idle = None
+
+    async def start(self, bot):
+        if self._workers:
+            return
+        self.bot = bot
+        self._ready = asyncio.PriorityQueue()
+        self._idle = asyncio.Event()
+        if self._pending == 0:
+            self._idle.set()
+        # Calls queued before start
+        for chat_id, chat in self._chats.items():
+            if chat.jobs and not chat.active:
+                self._schedule(chat_id, chat)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f'send-queue-{i}')
+            for i in range(self.max_concurrency)
+        ]
+
+    async def stop(self, timeout=10):
+        """Waits up to ``timeout`` seconds for queued calls, then stops the workers."""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Send queue stopped with %d undelivered calls", self._pending)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def enqueue(self, method, chat_id, priority=PRIORITY_NORMAL, **kwargs):
+        """Queues ``bot.<method>(chat_id=chat_id, **kwargs)`` and returns a future for its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # The last item counts delivery attempts
+        job = [method, chat_id, kwargs, future, 0]
+
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(TokenBucket(self.per_chat_rate, self.per_chat_burst))
+        heapq.heappush(chat.jobs, (priority, next(self._seq), job))
+
+        self._pending += 1
+        if self._idle is not None:
+            self._idle.clear()
+        if not chat.active and self._ready is not None:
+            self._schedule(chat_id, chat)
+        return future
+
+    def send_message(self, chat_id, text, priority=PRIORITY_NORMAL, **kwargs):
+        return self.enqueue('send_message', chat_id, priority, text=text, **kwargs)
+
+    def send_photo(self, chat_id, photo, priority=PRIORITY_NORMAL, **kwargs):
+        return self.enqueue('send_photo', chat_id, priority, photo=photo, **kwargs)
+
+    def send_media_group(self, chat_id, media, priority=PRIORITY_NORMAL, **kwargs):
+        return self.enqueue('send_media_group', chat_id, priority, media=media, **kwargs)
+
+    def _schedule(self, chat_id, chat):
+        chat.active = True
+        priority, seq, _ = chat.jobs[0]
+        wait = chat.bucket.delay()
+        if wait > 0:
+            asyncio.get_running_loop().call_later(wait, self._ready.put_nowait, (priority, seq, chat_id))
+        else:
+            self._ready.put_nowait((priority, seq, chat_id))
+
+    def _finish(self, chat_id, chat):
+        chat.active = False
+        if chat.jobs:
+            self._schedule(chat_id, chat)
+        else:
+            asyncio.get_running_loop().call_later(chat.bucket.idle_delay(), self._prune, chat_id)
+
+    def _prune(self, chat_id):
+        chat = self._chats.get(chat_id)
+        if chat is not None and not chat.active and not chat.jobs:
+            del self._chats[chat_id]
+
+    async def _worker(self):
+        while True:
+            _, _, chat_id = await self._ready.get()
+            chat = self._chats[chat_id]
+
+            # The bucket may have been blocked by RetryAfter since scheduling
+            wait = chat.bucket.delay()
+            if wait > 0:
+                chat.active = False
+                self._schedule(chat_id, chat)
+                continue
+
+            await self.global_bucket.acquire()
+            chat.bucket.take()
+            priority, seq, job = heapq.heappop(chat.jobs)
+            retry = await self._deliver(chat, job)
+            if retry:
+                heapq.heappush(chat.jobs, (priority, seq, job))
+            else:
+                self._done()
+            self._finish(chat_id, chat)
+
+    async def _deliver(self, chat, job):
+        """Makes the call; returns True when it should be retried later."""
+        method, chat_id, kwargs, future, attempts = job
+        try:
+            result = await getattr(self.bot, method)(chat_id=chat_id, **kwargs)
+        except RetryAfter as e:
+            logger.warning("Flood limit for chat %s, retrying %s in %ss", chat_id, method, e.retry_after)
+            chat.bucket.block(e.retry_after)
+            return True
+        except (TimedOut, NetworkError) as e:
+            if isinstance(e, (Forbidden, BadRequest)) or attempts >= self.max_retries:
+                self._fail(future, method, chat_id, e)
+                return False
+            backoff = min(2 ** attempts, 60)
+            logger.warning("Sending %s to chat %s failed (%s), retrying in %ss", method, chat_id, e, backoff)
+            job[4] = attempts + 1
+            chat.bucket.block(backoff)
+            return True
+        except Exception as e:
+            self._fail(future, method, chat_id, e)
+            return False
+
+        if not future.done():
+            future.set_result(result)
+        return False
+
+    def _fail(self, future, method, chat_id, error):
+        logger.error("Could not send %s to chat %s: %s", method, chat_id, error)
+        if not future.done():
+            future.set_exception(error)
+            # Handlers don't await these futures, don't report the error twice
+            future.exception()
+
+    def _done(self):
+        self._pending -= 1
+        if self._pending == 0:
+            self._idle.set()
+
+
+# Create global send queue instance
+send_queue = SendQueue(
+    global_rate=float(os.getenv('SEND_GLOBAL_RATE', 30)),
+    per_chat_rate=float(os.getenv('SEND_PER_CHAT_RATE', 1)),
+    per_chat_burst=int(os.getenv('SEND_PER_CHAT_BURST', 3)),
+    max_concurrency=int(os.getenv('SEND_CONCURRENCY', 8)),
+    max_retries=int(os.getenv('SEND_MAX_RETRIES', 5))
+)
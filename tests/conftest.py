@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from async_db import AsyncDatabase
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / 'store_bot.db'))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def adb(database):
+    adb = AsyncDatabase(database)
+    yield adb
+    adb.shutdown()
+
+
+@pytest.fixture
+def store_bot(monkeypatch):
+    monkeypatch.setenv('BOT_TOKEN', '1:test')
+    monkeypatch.setenv('ADMIN_ID', '1')
+    from bot import StoreBot
+    return StoreBot()
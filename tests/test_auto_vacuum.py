@@ -0,0 +1,50 @@
+import sqlite3
+import logging
+
+from database import Database
+
+
+def legacy_file(path):
+    # Created the way the first releases did, without incremental auto-vacuum
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE legacy (id INTEGER PRIMARY KEY)')
+    conn.close()
+    return path
+
+
+def auto_vacuum_mode(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_existing_file_is_not_rebuilt_unless_asked(tmp_path, caplog):
+    path = legacy_file(str(tmp_path / 'store_bot.db'))
+    database = Database(path)
+    with caplog.at_level(logging.WARNING, logger='database'):
+        database.ensure_schema()
+    database.close()
+
+    assert auto_vacuum_mode(path) == 0
+    assert 'AUTO_VACUUM_CONVERT' in caplog.text
+
+    database = Database(path)
+    with database.connection() as conn:
+        assert database.incremental_vacuum(conn.cursor(), 100) == 0
+    database.close()
+
+
+def test_opt_in_converts_existing_file(tmp_path):
+    path = legacy_file(str(tmp_path / 'store_bot.db'))
+    database = Database(path, convert_auto_vacuum=True)
+    database.ensure_schema()
+    database.close()
+
+    assert auto_vacuum_mode(path) == 2
+
+
+def test_new_file_starts_incremental(database):
+    database.ensure_schema()
+    assert auto_vacuum_mode(database.db_path) == 2
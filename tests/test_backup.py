@@ -0,0 +1,57 @@
+import os
+import asyncio
+import sqlite3
+
+from backup import BackupManager
+
+
+def test_back_to_back_backups_keep_separate_snapshots(adb, database, tmp_path):
+    manager = BackupManager(database, directory=str(tmp_path / 'backups'), keep=2, step_sleep=0)
+
+    async def scenario():
+        await adb.add_product(name='Apple', price=2.0, description='d', quantity=3)
+        return [await manager.run() for _ in range(3)]
+
+    paths = asyncio.run(scenario())
+
+    assert None not in paths
+    assert len(set(paths)) == 3
+    # Only the two newest are kept, in the order they were taken
+    assert manager.snapshots() == paths[1:]
+    for path in paths[1:]:
+        conn = sqlite3.connect(path)
+        assert conn.execute('SELECT name FROM products').fetchall() == [('Apple',)]
+        assert conn.execute('PRAGMA journal_mode').fetchone() == ('delete',)
+        conn.close()
+
+
+def no_hard_links(source, target):
+    raise PermissionError(1, 'Operation not permitted')
+
+
+def test_snapshot_is_published_without_hard_link_support(database, tmp_path, monkeypatch):
+    monkeypatch.setattr('backup.os.link', no_hard_links)
+    manager = BackupManager(database, directory=str(tmp_path / 'backups'), keep=2, step_sleep=0)
+
+    first = asyncio.run(manager.run())
+    second = asyncio.run(manager.run())
+
+    assert first and second and first != second
+    assert manager.snapshots() == [first, second]
+    assert not [name for name in os.listdir(manager.directory) if name.endswith('.partial')]
+    conn = sqlite3.connect(second)
+    assert conn.execute('PRAGMA integrity_check').fetchone() == ('ok',)
+    conn.close()
+
+
+def test_failed_publish_leaves_no_files(database, tmp_path, monkeypatch):
+    def broken_replace(source, target):
+        raise OSError(5, 'Input/output error')
+
+    monkeypatch.setattr('backup.os.link', no_hard_links)
+    monkeypatch.setattr('backup.os.replace', broken_replace)
+    manager = BackupManager(database, directory=str(tmp_path / 'backups'), step_sleep=0)
+
+    assert asyncio.run(manager.run()) is None
+    assert manager.last_result['error']
+    assert os.listdir(manager.directory) == []
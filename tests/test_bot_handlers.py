@@ -0,0 +1,33 @@
+import pytest
+from telegram import Update
+from telegram.ext import Application, ConversationHandler
+
+
+def callback_update(bot, data, user_id=1):
+    return Update.de_json({
+        'update_id': 1,
+        'callback_query': {
+            'id': 'q1',
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'A'},
+            'chat_instance': 'c',
+            'data': data,
+            'message': {'message_id': 1, 'date': 0, 'chat': {'id': user_id, 'type': 'private'}, 'text': 'menu'},
+        },
+    }, bot)
+
+
+@pytest.mark.parametrize('data', ['add_new_product', 'payment_made', 'continue_to_payment', 'add_new_crypto'])
+def test_conversation_entry_points_go_through_router(store_bot, data):
+    application = Application.builder().token('1:test').updater(None).build()
+    store_bot.setup_handlers(application)
+    update = callback_update(application.bot, data)
+
+    entries = [
+        entry
+        for handler in application.handlers[0] if isinstance(handler, ConversationHandler)
+        for entry in handler.entry_points if entry.check_update(update)
+    ]
+    # One conversation starts on the button, and the router answers its query
+    assert len(entries) == 1
+    assert entries[0].callback == store_bot.button_handler
+    assert store_bot.router.resolve(data)[0].name == data
@@ -0,0 +1,58 @@
+import pytest
+
+from callback_codec import CallbackCodec, CallbackDataError, MAX_CALLBACK_DATA, MARKER
+
+
+@pytest.fixture
+def codec():
+    codec = CallbackCodec(b'secret')
+    codec.register('add_to_cart', (int,))
+    codec.register('set_qty', (int, int))
+    codec.register('category', (str,))
+    return codec
+
+
+def test_round_trip_keeps_argument_types(codec):
+    for name, args in [
+        ('add_to_cart', (0,)),
+        ('add_to_cart', (2 ** 40,)),
+        ('set_qty', (17, -3)),
+        ('category', ('Puuviljad 🍎',)),
+        ('category', ('',)),
+    ]:
+        data = codec.encode(name, *args)
+        assert data.startswith(MARKER)
+        assert len(data.encode()) <= MAX_CALLBACK_DATA
+        assert codec.decode(data) == (name, args)
+
+
+def test_encode_rejects_bad_calls(codec):
+    with pytest.raises(KeyError):
+        codec.encode('unknown', 1)
+    with pytest.raises(ValueError):
+        codec.encode('set_qty', 1)
+    with pytest.raises(ValueError):
+        codec.encode('category', 'x' * 60)
+
+
+def test_decode_rejects_tampered_and_foreign_data(codec):
+    data = codec.encode('set_qty', 1, 2)
+    # Flip a character in the middle; the last one may only carry padding bits
+    middle = len(data) // 2
+    tampered = data[:middle] + ('A' if data[middle] != 'A' else 'B') + data[middle + 1:]
+
+    for bad in [
+        'view_cart',
+        MARKER,
+        MARKER + '!!!',
+        tampered,
+        MARKER + 'AAAA',
+    ]:
+        with pytest.raises(CallbackDataError):
+            codec.decode(bad)
+
+    # Same routes but a different secret never verifies
+    other = CallbackCodec(b'other')
+    other.register('set_qty', (int, int))
+    with pytest.raises(CallbackDataError):
+        codec.decode(other.encode('set_qty', 1, 2))
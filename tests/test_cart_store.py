@@ -0,0 +1,63 @@
+import asyncio
+
+from cart_store import CartStore
+
+
+def test_full_cache_of_dirty_carts_still_serves_new_user(adb):
+    async def scenario():
+        product_id = await adb.add_product(name='Apple', price=2.0, description='d', quantity=10)
+        store = CartStore(adb, max_users=2)
+
+        await store.add(1, product_id)
+        await store.add(2, product_id)
+        # Both cached carts are dirty, so nothing can be evicted for user 3
+        assert await store.add(3, product_id) == ('added', 'Apple', 1)
+        assert await store.get_items(3) == [(product_id, 1, 'Apple', 2.0)]
+
+        # Once flushed, the cache shrinks back to its limit
+        assert await store.flush() == 3
+        assert len(store._carts) == 2
+
+    asyncio.run(scenario())
+
+
+def holds(database):
+    with database.connection() as conn:
+        return dict(conn.execute('SELECT product_id, quantity FROM stock_holds WHERE user_id = 1').fetchall())
+
+
+def test_add_respects_stock_held_by_others(adb):
+    async def scenario():
+        product_id = await adb.add_product(name='Apple', price=2.0, description='d', quantity=3)
+        store = CartStore(adb)
+
+        assert await adb.hold_stock(2, product_id, 2) == ('held', 'Apple')
+        assert await store.add(1, product_id) == ('added', 'Apple', 1)
+        assert await store.add(1, product_id) == ('insufficient', 'Apple', None)
+        assert await store.add(1, 999) == ('not_found', None, None)
+        assert await store.get_items(1) == [(product_id, 1, 'Apple', 2.0)]
+
+    asyncio.run(scenario())
+
+
+def test_bulk_operations_update_memory_holds_and_flushed_cart(adb, database):
+    async def scenario():
+        apple = await adb.add_product(name='Apple', price=2.0, description='d', quantity=5)
+        pear = await adb.add_product(name='Pear', price=1.0, description='d', quantity=5)
+        store = CartStore(adb)
+
+        await store.add(1, apple)
+        # Capped at the stock, and 0 removes the line
+        assert await store.set_quantities(1, {pear: 9}) == {apple: 1, pear: 5}
+        assert await store.set_quantities(1, {apple: 0, pear: 2}) == {pear: 2}
+        assert holds(database) == {pear: 2}
+
+        await store.remove(1, [pear])
+        assert await store.get_items(1) == []
+        assert holds(database) == {}
+
+        await store.set_quantities(1, {apple: 3})
+        await store.flush()
+        assert await adb.get_cart_lines(1) == {apple: 3}
+
+    asyncio.run(scenario())
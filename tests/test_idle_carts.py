@@ -0,0 +1,54 @@
+def add_lines(database, lines):
+    with database.connection() as conn:
+        conn.executemany('''
+            INSERT INTO cart (user_id, product_id, quantity, added_at)
+            VALUES (?, ?, ?, datetime('now', ?))
+        ''', lines)
+
+
+def cart_users(database):
+    with database.connection() as conn:
+        return [row[0] for row in conn.execute('SELECT DISTINCT user_id FROM cart ORDER BY user_id')]
+
+
+def test_only_fully_idle_carts_are_deleted_oldest_first(database):
+    add_lines(database, [
+        # Idle for 10 days
+        (1, 1, 2, '-10 days'),
+        (1, 2, 1, '-9 days'),
+        # One old line, but touched yesterday
+        (2, 1, 1, '-20 days'),
+        (2, 2, 1, '-1 days'),
+        # Recent
+        (3, 1, 1, '-1 days'),
+        # The oldest idle cart
+        (4, 1, 3, '-30 days'),
+    ])
+
+    assert database.write(database.delete_idle_carts, 7, 1) == [4]
+    assert database.write(database.delete_idle_carts, 7) == [1]
+    assert database.write(database.delete_idle_carts, 7) == []
+    assert cart_users(database) == [2, 3]
+
+    with database.connection() as conn:
+        stats = conn.execute('SELECT product_id, carts, quantity FROM abandoned_cart_stats ORDER BY product_id').fetchall()
+    assert stats == [(1, 2, 5), (2, 1, 1)]
+
+
+def test_idle_lookup_is_driven_by_added_at_index(database):
+    add_lines(database, [(user_id, product_id, 1, f'-{user_id % 30} days') for user_id in range(300) for product_id in range(3)])
+
+    statements = []
+    with database.connection() as conn:
+        conn.execute('ANALYZE')
+        conn.set_trace_callback(statements.append)
+        try:
+            database.delete_idle_carts(conn.cursor(), 7, 10)
+        finally:
+            conn.set_trace_callback(None)
+
+        lookup = next(sql for sql in statements if sql.lstrip().startswith('SELECT DISTINCT'))
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + lookup)]
+
+    assert plan[0] == 'SEARCH idle USING COVERING INDEX idx_cart_added (added_at<?)'
+    assert not any(detail.startswith('SCAN') for detail in plan)
@@ -0,0 +1,76 @@
+import sqlite3
+
+import migrations
+
+# (id, order_id, user_id, product_id, product_name, quantity, total_price, status)
+OLD_ORDERS = [
+    # Single line with a discount: the unit price comes from the total
+    (1, 'A', 7, 1, 'Apple', 3, 5.97, 'pending'),
+    # Two lines repeating the order total: unit prices come from the products
+    (2, 'B', 7, 1, 'Apple', 1, 4.50, 'completed'),
+    (3, 'B', 7, 2, 'Pear', 2, 4.50, 'completed'),
+    # Single line whose product was deleted: still split from the total
+    (4, 'C', 8, 99, 'Ghost', 2, 3.00, 'completed'),
+    # Lines of a multi-line order whose product was deleted get no price
+    (5, 'D', 8, 99, 'Ghost', 1, 3.50, 'pending'),
+    (6, 'D', 8, 1, 'Apple', 1, 3.50, 'pending'),
+]
+
+
+def build_v7_database(path, monkeypatch):
+    conn = sqlite3.connect(path, isolation_level=None)
+    with monkeypatch.context() as patch:
+        patch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS[:7])
+        patch.setattr(migrations, 'LATEST_VERSION', 7)
+        assert migrations.migrate(conn) == 7
+
+    conn.executemany(
+        'INSERT INTO products (id, name, price, description, quantity) VALUES (?, ?, ?, ?, ?)',
+        [(1, 'Apple', 2.0, 'd', 10), (2, 'Pear', 1.25, 'd', 10)]
+    )
+    conn.executemany('''
+        INSERT INTO orders (id, order_id, user_id, product_id, product_name, quantity, total_price, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', OLD_ORDERS)
+    return conn
+
+
+def counters(conn):
+    return dict(conn.execute("SELECT name, value FROM stats_counters WHERE name = 'orders' OR name LIKE 'orders.%'").fetchall())
+
+
+def test_normalized_orders_migrates_old_rows(tmp_path, monkeypatch):
+    conn = build_v7_database(str(tmp_path / 'old.db'), monkeypatch)
+    # Before the migration every line counted as an order
+    assert counters(conn)['orders'] == 6
+
+    assert migrations.migrate(conn) == migrations.LATEST_VERSION
+
+    headers = conn.execute('SELECT id, order_id, user_id, total_cents, status FROM orders ORDER BY id').fetchall()
+    assert headers == [
+        (1, 'A', 7, 597, 'pending'),
+        (2, 'B', 7, 450, 'completed'),
+        (4, 'C', 8, 300, 'completed'),
+        (5, 'D', 8, 350, 'pending'),
+    ]
+
+    items = conn.execute('''
+        SELECT order_id, line, product_id, product_name, quantity, unit_price_cents
+        FROM order_items ORDER BY order_id, line
+    ''').fetchall()
+    assert items == [
+        ('A', 1, 1, 'Apple', 3, 199),
+        ('B', 1, 1, 'Apple', 1, 200),
+        ('B', 2, 2, 'Pear', 2, 125),
+        ('C', 1, 99, 'Ghost', 2, 150),
+        ('D', 1, 99, 'Ghost', 1, None),
+        ('D', 2, 1, 'Apple', 1, 200),
+    ]
+
+    assert counters(conn) == {'orders': 4, 'orders.pending': 2, 'orders.completed': 2}
+
+    # The rebuilt triggers keep counting headers, not lines
+    conn.execute("INSERT INTO orders (order_id, user_id, total_cents) VALUES ('E', 9, 100)")
+    conn.execute("UPDATE orders SET status = 'completed' WHERE order_id = 'A'")
+    assert counters(conn) == {'orders': 5, 'orders.pending': 2, 'orders.completed': 3}
+    conn.close()
@@ -0,0 +1,32 @@
+import asyncio
+
+
+def order_data(items, **overrides):
+    data = dict(
+        order_id='ORD1', user_id=5, user_name='a', items=items, total=4.0,
+        currency='xmr', payment_source='addr', clear_cart=True
+    )
+    data.update(overrides)
+    return data
+
+
+def row_counts(database):
+    with database.connection() as conn:
+        return [conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in ('orders', 'order_items', 'outbox')]
+
+
+def test_empty_checkout_places_nothing(adb, database):
+    async def scenario():
+        product_id = await adb.add_product(name='Apple', price=2.0, description='d', quantity=3)
+        empty = await adb.create_order(**order_data([]))
+        placed = await adb.create_order(**order_data(
+            [{'product_id': product_id, 'name': 'Apple', 'quantity': 2, 'price': 2.0}], order_id='ORD2'
+        ))
+        return empty, placed
+
+    empty, placed = asyncio.run(scenario())
+
+    assert empty == {'status': 'empty', 'order_id': 'ORD1'}
+    assert placed == {'status': 'placed', 'order_id': 'ORD2'}
+    # Only the real order and its admin alert were written
+    assert row_counts(database) == [1, 1, 1]
@@ -0,0 +1,80 @@
+import asyncio
+
+from telegram.error import Forbidden, NetworkError
+
+import bot
+from outbox import OutboxDispatcher
+
+PAYLOAD = {
+    'order_id': 'ORD1',
+    # (user_id, product_name, quantity, image1, image2, coordinates)
+    'deliveries': [[5, 'Apple', 1, 'photo-a', 'photo-b', '59.4,24.7']],
+}
+
+
+class FakeSendQueue:
+    def __init__(self, failures):
+        self.sent = []
+        # method -> exceptions raised by its next calls
+        self.failures = failures
+
+    def _send(self, method):
+        future = asyncio.get_running_loop().create_future()
+        errors = self.failures.get(method)
+        if errors:
+            future.set_exception(errors.pop(0))
+        else:
+            self.sent.append(method)
+            future.set_result(True)
+        return future
+
+    def send_message(self, chat_id, text, priority=None, **kwargs):
+        return self._send('send_message')
+
+    def send_photo(self, chat_id, photo, priority=None, **kwargs):
+        return self._send('send_photo')
+
+    def send_media_group(self, chat_id, media, priority=None, **kwargs):
+        return self._send('send_media_group')
+
+
+def outbox_row(database):
+    with database.connection() as conn:
+        return conn.execute('SELECT status, attempts, delivered FROM outbox').fetchone()
+
+
+def run_dispatch(adb, store_bot, queue, monkeypatch, rounds):
+    monkeypatch.setattr(bot, 'send_queue', queue)
+    dispatcher = OutboxDispatcher(adb)
+    dispatcher.register('order_completed', store_bot.send_order_delivery, parts=True)
+
+    async def scenario():
+        for _ in range(rounds):
+            await dispatcher.dispatch()
+            # Make a rescheduled row due again
+            with adb.database.connection() as conn:
+                conn.execute('UPDATE outbox SET next_attempt_at = CURRENT_TIMESTAMP')
+
+    asyncio.run(scenario())
+
+
+def test_retry_skips_messages_already_delivered(adb, database, store_bot, monkeypatch):
+    database.write(database.enqueue_notification, 'order_completed:ORD1', 'order_completed', PAYLOAD)
+    queue = FakeSendQueue({'send_media_group': [NetworkError('timeout')]})
+
+    run_dispatch(adb, store_bot, queue, monkeypatch, rounds=1)
+    assert queue.sent == ['send_message']
+    assert outbox_row(database) == ('pending', 1, '[0]')
+
+    run_dispatch(adb, store_bot, queue, monkeypatch, rounds=2)
+    assert queue.sent == ['send_message', 'send_media_group']
+    assert outbox_row(database) == ('sent', 2, '[0]')
+
+
+def test_permanent_error_fails_the_row_at_once(adb, database, store_bot, monkeypatch):
+    database.write(database.enqueue_notification, 'order_completed:ORD1', 'order_completed', PAYLOAD)
+    queue = FakeSendQueue({'send_message': [Forbidden('bot was blocked by the user')]})
+
+    run_dispatch(adb, store_bot, queue, monkeypatch, rounds=3)
+    assert queue.sent == ['send_media_group']
+    assert outbox_row(database) == ('failed', 1, '[1]')
@@ -0,0 +1,78 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from callback_codec import CallbackCodec
+from router import CallbackRouter
+
+
+async def handler(update, context, *args):
+    return args
+
+
+@pytest.fixture
+def router():
+    router = CallbackRouter(is_admin=lambda user_id: user_id == 1, codec=CallbackCodec(b'secret'))
+    router.exact('view_cart', handler)
+    router.prefix('product_', handler, int)
+    router.prefix('admin_confirm_', handler, int, admin_only=True)
+    router.prefix('admin_confirm_yes_', handler, int, admin_only=True)
+    router.prefix('category_', handler, str)
+    return router
+
+
+def test_exact_and_longest_prefix_win(router):
+    assert router.resolve('view_cart')[0].name == 'view_cart'
+    assert router.resolve('product_12') == (router._by_name['product_'], (12,))
+    assert router.resolve('admin_confirm_yes_7')[0].name == 'admin_confirm_yes_'
+    assert router.resolve('admin_confirm_7')[0].name == 'admin_confirm_'
+    # The last argument keeps its underscores
+    assert router.resolve('category_fresh_fruit')[1] == ('fresh_fruit',)
+
+
+def test_unparseable_and_unknown_data_is_not_routed(router):
+    assert router.resolve('product_') is None
+    assert router.resolve('product_abc') is None
+    assert router.resolve('nothing') is None
+    assert router.resolve('view_cart_extra') is None
+
+
+def test_encoded_buttons_resolve_and_reject_tampering(router):
+    data = router.data('admin_confirm_yes_', 42)
+    assert router.resolve(data) == (router._by_name['admin_confirm_yes_'], (42,))
+    assert router.resolve(data[:-2]) is None
+
+    matches = router.pattern('product_')
+    assert matches(router.data('product_', 3))
+    assert matches('product_3')
+    assert not matches(data)
+    assert not matches(None)
+
+
+def test_duplicate_routes_are_rejected(router):
+    with pytest.raises(ValueError):
+        router.exact('view_cart', handler)
+    with pytest.raises(ValueError):
+        router.prefix('product_', handler, int)
+
+
+class FakeQuery:
+    def __init__(self, data, user_id):
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id)
+        self.answers = []
+
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append((text, show_alert))
+
+
+def test_dispatch_checks_admin_and_answers_query(router):
+    async def dispatch(data, user_id):
+        query = FakeQuery(data, user_id)
+        result = await router.dispatch(SimpleNamespace(callback_query=query), None)
+        return result, query.answers
+
+    assert asyncio.run(dispatch('admin_confirm_5', 1)) == ((5,), [(None, False)])
+    assert asyncio.run(dispatch('admin_confirm_5', 2)) == (None, [("Access denied!", True)])
+    assert asyncio.run(dispatch('bogus', 2)) == (None, [("This button is not available.", True)])
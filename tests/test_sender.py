@@ -0,0 +1,80 @@
+import time
+import asyncio
+
+import pytest
+from telegram.error import Forbidden, RetryAfter
+
+from sender import SendQueue, PRIORITY_HIGH, PRIORITY_LOW
+
+
+class FakeBot:
+    def __init__(self, failures=None):
+        self.sent = []
+        # chat_id -> exceptions raised by the next calls for that chat
+        self.failures = failures or {}
+
+    async def send_message(self, chat_id, text):
+        errors = self.failures.get(chat_id)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((chat_id, text, time.monotonic()))
+        return text
+
+
+def fast_queue(**kwargs):
+    return SendQueue(global_rate=1000, per_chat_rate=1000, per_chat_burst=10, max_concurrency=4, **kwargs)
+
+
+def test_priority_and_per_chat_order():
+    async def scenario():
+        queue = fast_queue()
+        bot = FakeBot()
+        # Queued before start, delivered by priority and then arrival
+        futures = [
+            queue.send_message(1, 'low', PRIORITY_LOW),
+            queue.send_message(1, 'first'),
+            queue.send_message(1, 'urgent', PRIORITY_HIGH),
+            queue.send_message(1, 'second'),
+        ]
+        await queue.start(bot)
+        results = await asyncio.gather(*futures)
+        await queue.stop()
+        return results, bot.sent, queue.pending
+
+    results, sent, pending = asyncio.run(scenario())
+    assert results == ['low', 'first', 'urgent', 'second']
+    assert [text for _, text, _ in sent] == ['urgent', 'first', 'second', 'low']
+    assert pending == 0
+
+
+def test_retry_after_pauses_only_that_chat():
+    async def scenario():
+        queue = fast_queue()
+        bot = FakeBot({1: [RetryAfter(1)]})
+        await queue.start(bot)
+        started = time.monotonic()
+        slow = queue.send_message(1, 'limited')
+        fast = queue.send_message(2, 'free')
+        await asyncio.gather(slow, fast)
+        await queue.stop()
+        return {chat_id: at - started for chat_id, _, at in bot.sent}
+
+    delays = asyncio.run(scenario())
+    assert delays[2] < 0.5
+    assert delays[1] >= 0.9
+
+
+def test_permanent_errors_fail_the_future_without_retrying():
+    async def scenario():
+        queue = fast_queue()
+        bot = FakeBot({1: [Forbidden('blocked by user')]})
+        await queue.start(bot)
+        future = queue.send_message(1, 'hello')
+        with pytest.raises(Forbidden):
+            await future
+        await queue.stop(timeout=1)
+        return bot.sent, queue.pending
+
+    sent, pending = asyncio.run(scenario())
+    assert sent == []
+    assert pending == 0
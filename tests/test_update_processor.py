@@ -0,0 +1,85 @@
+import asyncio
+
+from telegram import Update
+
+from update_processor import PerUserUpdateProcessor
+
+
+def message_update(update_id, user_id):
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'A'},
+            'text': 'hi',
+        },
+    }, None)
+
+
+def test_same_user_runs_in_order_while_others_run_concurrently():
+    async def scenario():
+        processor = PerUserUpdateProcessor(2, 16)
+        events = []
+        running = {'now': 0, 'max': 0}
+
+        async def handle(update_id, user_id):
+            running['now'] += 1
+            running['max'] = max(running['max'], running['now'])
+            events.append(('start', user_id, update_id))
+            await asyncio.sleep(0.02)
+            events.append(('end', user_id, update_id))
+            running['now'] -= 1
+
+        updates = [(1, 10), (2, 10), (3, 20), (4, 10), (5, 30)]
+        await asyncio.gather(*(
+            processor.process_update(message_update(update_id, user_id), handle(update_id, user_id))
+            for update_id, user_id in updates
+        ))
+        return processor, events, running['max']
+
+    processor, events, max_running = asyncio.run(scenario())
+
+    # User 10's updates never overlap and keep their arrival order
+    user_events = [(kind, update_id) for kind, user_id, update_id in events if user_id == 10]
+    assert user_events == [('start', 1), ('end', 1), ('start', 2), ('end', 2), ('start', 4), ('end', 4)]
+
+    # Other users ran next to user 10, but never more than the running limit
+    assert max_running == 2
+    first_end = events.index(('end', 10, 1))
+    assert ('start', 20, 3) in events[:first_end]
+
+    metrics = processor.metrics()
+    assert metrics['processed'] == 5
+    assert metrics['waiting'] == metrics['running'] == 0
+    assert processor._locks == {}
+
+
+def test_cancelled_waiting_update_is_dropped_and_counted_out():
+    async def scenario():
+        processor = PerUserUpdateProcessor(1, 16)
+        release = asyncio.Event()
+
+        async def blocker():
+            await release.wait()
+
+        async def never_runs():
+            raise AssertionError("cancelled update ran")
+
+        first = asyncio.create_task(processor.process_update(message_update(1, 10), blocker()))
+        second = asyncio.create_task(processor.process_update(message_update(2, 10), never_runs()))
+        await asyncio.sleep(0.01)
+        assert processor.metrics()['waiting'] == 1
+
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        release.set()
+        await first
+        return processor
+
+    processor = asyncio.run(scenario())
+    metrics = processor.metrics()
+    assert metrics['processed'] == 1
+    assert metrics['waiting'] == 0
+    assert processor._locks == {}
@@ -0,0 +1,161 @@
+import json
+import asyncio
+from urllib.parse import parse_qsl
+
+from telegram.ext import Application, CommandHandler
+
+from webhook import WebhookServer
+from update_processor import PerUserUpdateProcessor
+
+SECRET = 's3cret'
+
+START_UPDATE = {
+    'update_id': 1,
+    'message': {
+        'message_id': 1,
+        'date': 0,
+        'chat': {'id': 5, 'type': 'private'},
+        'from': {'id': 5, 'is_bot': False, 'first_name': 'A'},
+        'text': '/start',
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+    },
+}
+
+
+def decode_param(value):
+    # PTB form-encodes parameters, JSON-encoding everything except plain strings
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+class FakeBotApi:
+    """Answers Bot API calls over plain HTTP and records them."""
+
+    def __init__(self):
+        self.calls = asyncio.Queue()
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return f"http://127.0.0.1:{self._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                lines = head.decode().split('\r\n')
+                target = lines[0].split(' ')[1]
+                headers = dict(line.split(':', 1) for line in lines[1:] if line)
+                headers = {name.strip().lower(): value.strip() for name, value in headers.items()}
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                method = target.rsplit('/', 1)[1]
+                params = {name: decode_param(value) for name, value in parse_qsl(body.decode())}
+                await self.calls.put((method, params))
+
+                if method == 'getMe':
+                    result = {'id': 1, 'is_bot': True, 'first_name': 'Bot', 'username': 'bot'}
+                elif method == 'sendMessage':
+                    result = {'message_id': 2, 'date': 0, 'chat': {'id': params['chat_id'], 'type': 'private'}, 'text': params['text']}
+                else:
+                    result = True
+                payload = json.dumps({'ok': True, 'result': result}).encode()
+                writer.write(
+                    f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def request(port, method, path, body=None, secret=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    data = body if isinstance(body, bytes) else json.dumps(body).encode() if body is not None else b''
+    head = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(data)}\r\nConnection: close\r\n"
+    if secret:
+        head += f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+    writer.write(head.encode() + b'\r\n' + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status_line, _, payload = response.decode().partition('\r\n\r\n')
+    return int(status_line.split(' ')[1]), json.loads(payload)
+
+
+async def with_webhook(check):
+    api = FakeBotApi()
+    api_url = await api.start()
+
+    async def start(update, context):
+        await context.bot.send_message(update.effective_chat.id, 'Welcome!')
+
+    application = (
+        Application.builder()
+        .token('1:test')
+        .base_url(f"{api_url}/bot")
+        .updater(None)
+        .concurrent_updates(PerUserUpdateProcessor(4, 16))
+        .build()
+    )
+    application.add_handler(CommandHandler('start', start))
+    server = WebhookServer(application, port=0, secret_token=SECRET)
+
+    await application.initialize()
+    await application.start()
+    await server.start()
+    try:
+        assert (await api.calls.get())[0] == 'getMe'
+        await check(server.port, api)
+    finally:
+        await server.stop()
+        await application.stop()
+        await application.shutdown()
+        await api.stop()
+
+
+def test_update_round_trip_reaches_handler_and_bot_api():
+    async def check(port, api):
+        assert await request(port, 'POST', '/webhook', START_UPDATE, secret=SECRET) == (200, {'ok': True})
+
+        method, params = await asyncio.wait_for(api.calls.get(), timeout=5)
+        assert method == 'sendMessage'
+        assert params['chat_id'] == 5
+        assert params['text'] == 'Welcome!'
+
+    asyncio.run(with_webhook(check))
+
+
+def test_rejected_requests_never_reach_the_update_queue():
+    async def check(port, api):
+        assert (await request(port, 'POST', '/webhook', START_UPDATE))[0] == 403
+        assert (await request(port, 'POST', '/webhook', START_UPDATE, secret='wrong'))[0] == 403
+        # Non-ASCII header bytes are a mismatch, not a crash
+        assert (await request(port, 'POST', '/webhook', START_UPDATE, secret='sëcret'))[0] == 403
+        assert (await request(port, 'POST', '/webhook', b'not json', secret=SECRET))[0] == 400
+        assert (await request(port, 'POST', '/other', START_UPDATE, secret=SECRET))[0] == 404
+        assert (await request(port, 'GET', '/webhook'))[0] == 405
+
+        await asyncio.sleep(0.1)
+        assert api.calls.empty()
+
+    asyncio.run(with_webhook(check))
+
+
+def test_health_reports_queue_and_processor_metrics():
+    async def check(port, api):
+        status, payload = await request(port, 'GET', '/health')
+        assert status == 200
+        assert payload['ok'] is True
+        assert payload['update_queue'] == 0
+        assert 'updates' in payload
+
+    asyncio.run(with_webhook(check))
@@ -0,0 +1,40 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from database import Database
+from async_db import AsyncDatabase
+
+
+def test_writes_fail_instead_of_hanging_when_connection_cannot_open(tmp_path):
+    adb = AsyncDatabase(Database(str(tmp_path / 'missing' / 'store_bot.db')))
+
+    async def scenario():
+        for _ in range(2):
+            # A second attempt starts a new writer and fails the same way
+            with pytest.raises(sqlite3.OperationalError):
+                await asyncio.wait_for(adb.update_content('about_us', 'x'), timeout=5)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        adb.shutdown()
+
+
+def test_writer_recovers_once_the_database_can_be_opened(tmp_path):
+    directory = tmp_path / 'later'
+    adb = AsyncDatabase(Database(str(directory / 'store_bot.db')))
+
+    async def scenario():
+        with pytest.raises(sqlite3.OperationalError):
+            await asyncio.wait_for(adb.update_content('about_us', 'x'), timeout=5)
+        directory.mkdir()
+        await asyncio.wait_for(adb.update_content('about_us', 'x'), timeout=5)
+        content, _ = await adb.get_reference_data()
+        assert dict(content)['about_us'] == 'x'
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        adb.shutdown()
@@ -0,0 +1,110 @@
+import time
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates from different users concurrently, one user at a time.
+
+    Updates sharing a key (the user, or the chat when there is no user) run
+    strictly in arrival order, so per-user state such as ``user_data`` and
+    conversation states is never touched by two handlers at once. Up to
+    ``max_concurrent_updates`` updates run at the same time.
+
+    The base class limit (``max_concurrent_updates`` as seen by the
+    Application) is set to ``max_pending_updates`` and only bounds how many
+    updates may be in flight, waiting or running. The running limit is
+    applied after the per-user lock is taken, so a user with a burst of
+    updates waits on their own lock instead of occupying slots other users
+    need.
+    """
+
+    def __init__(self, max_concurrent_updates, max_pending_updates=None):
+        if max_pending_updates is None:
+            max_pending_updates = max_concurrent_updates * 32
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self.max_running = max_concurrent_updates
+        self._running_slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # key -> [lock, number of updates holding or waiting for it]
+        self._locks = {}
+
+        self.waiting = 0
+        self.running = 0
+        self.max_waiting = 0
+        self.processed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @staticmethod
+    def update_key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return ('user', update.effective_user.id)
+        if update.effective_chat is not None:
+            return ('chat', update.effective_chat.id)
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self.update_key(update)
+        entry = None
+        if key is not None:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+
+        queued_at = time.monotonic()
+        started = False
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            if entry is not None:
+                await entry[0].acquire()
+            try:
+                async with self._running_slots:
+                    wait = time.monotonic() - queued_at
+                    started = True
+                    self.waiting -= 1
+                    self.running += 1
+                    self.total_wait += wait
+                    self.max_wait = max(self.max_wait, wait)
+                    try:
+                        await coroutine
+                    finally:
+                        self.running -= 1
+                        self.processed += 1
+            finally:
+                if entry is not None:
+                    entry[0].release()
+        finally:
+            if not started:
+                # Cancelled while waiting, the update is dropped
+                self.waiting -= 1
+                coroutine.close()
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    def metrics(self):
+        return {
+            'waiting': self.waiting,
+            'running': self.running,
+            'max_waiting': self.max_waiting,
+            'processed': self.processed,
+            'avg_wait_ms': round(self.total_wait / self.processed * 1000, 2) if self.processed else 0.0,
+            'max_wait_ms': round(self.max_wait * 1000, 2),
+        }
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self.processed:
+            logger.info("Update processor stats: %s", self.metrics())
@@ -0,0 +1,197 @@
+import json
+import asyncio
+import logging
+import secrets
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Telegram never sends updates anywhere near this big
+MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+
+# Idle keep-alive connections are closed after this many seconds
+KEEPALIVE_TIMEOUT = 75
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large',
+    503: 'Service Unavailable',
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status):
+        super().__init__(REASONS[status])
+        self.status = status
+
+
+class WebhookServer:
+    """Minimal HTTP/1.1 server that receives Telegram webhook updates.
+
+    ``POST <path>`` bodies are decoded into ``Update`` objects and put on the
+    application's update queue, exactly where polling would put them.
+    Requests without the configured ``X-Telegram-Bot-Api-Secret-Token``
+    are refused. ``GET <health_path>`` reports whether the application is
+    running and how many updates are waiting. Connections are kept alive
+    so a reverse proxy can reuse them; past ``max_connections`` new ones
+    get a 503.
+    """
+
+    def __init__(self, application, listen='127.0.0.1', port=8443, path='/webhook',
+                 secret_token=None, max_connections=40, health_path='/health'):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.max_connections = max_connections
+        self.health_path = health_path
+        self._server = None
+        self._connections = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.listen, self.port, limit=MAX_HEADER_SIZE
+        )
+        # Port 0 picks a free port, report the real one
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Webhook server listening on %s:%s%s", self.listen, self.port, self.path)
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._connections):
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle_connection(self, reader, writer):
+        if len(self._connections) >= self.max_connections:
+            await self._respond(writer, 503, {'ok': False, 'error': 'Too many connections'}, keep_alive=False)
+            writer.close()
+            return
+
+        self._connections.add(writer)
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), KEEPALIVE_TIMEOUT)
+                except HttpError as e:
+                    await self._respond(writer, e.status, {'ok': False, 'error': str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                method, target, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                status, payload = await self._route(method, target, headers, body)
+                await self._respond(writer, status, payload, keep_alive)
+        except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _read_request(self, reader):
+        """Returns ``(method, target, headers, body)`` or None when the client hung up."""
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise HttpError(400)
+        except asyncio.LimitOverrunError:
+            raise HttpError(431)
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            raise HttpError(400)
+
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise HttpError(400)
+            headers[name.strip().lower()] = value.strip()
+
+        body = b''
+        if method == 'POST':
+            if 'content-length' not in headers:
+                raise HttpError(411)
+            try:
+                length = int(headers['content-length'])
+            except ValueError:
+                raise HttpError(400)
+            if length > MAX_BODY_SIZE:
+                raise HttpError(413)
+            body = await reader.readexactly(length)
+
+        return method, target.split('?', 1)[0], headers, body
+
+    async def _route(self, method, target, headers, body):
+        if target == self.health_path:
+            if method != 'GET':
+                return 405, {'ok': False}
+            return self._health()
+
+        if target != self.path:
+            return 404, {'ok': False}
+        if method != 'POST':
+            return 405, {'ok': False}
+
+        # Compared as bytes: compare_digest rejects non-ASCII strings with a TypeError
+        if self.secret_token and not secrets.compare_digest(
+            headers.get('x-telegram-bot-api-secret-token', '').encode('latin-1'), self.secret_token.encode()
+        ):
+            logger.warning("Webhook request with a wrong secret token")
+            return 403, {'ok': False}
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception:
+            logger.warning("Could not decode webhook update", exc_info=True)
+            return 400, {'ok': False}
+
+        if update is None:
+            return 400, {'ok': False}
+
+        await self.application.update_queue.put(update)
+        return 200, {'ok': True}
+
+    def _health(self):
+        running = self.application.running
+        payload = {
+            'ok': running,
+            'update_queue': self.application.update_queue.qsize(),
+            'connections': len(self._connections),
+        }
+        metrics = getattr(self.application.update_processor, 'metrics', None)
+        if metrics is not None:
+            payload['updates'] = metrics()
+        return (200 if running else 503), payload
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode()
+        head = (
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            f"\r\n"
+        )
+        writer.write(head.encode() + body)
+        await writer.drain()
@@ -0,0 +1,146 @@
+import time
+import queue
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteQueue:
+    """Single writer thread that group-commits queued write operations.
+
+    Operations are callables taking a cursor as their first argument. Every
+    operation that arrives within ``batch_window_ms`` of the first one in a
+    batch runs inside the same ``BEGIN IMMEDIATE`` transaction, each under
+    its own savepoint, so one failing operation is rolled back on its own
+    while the rest of the batch still commits with a single fsync.
+    """
+
+    def __init__(self, database, batch_window_ms=5, max_batch=256):
+        self.database = database
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            self._start()
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Commits everything already queued, then stops the writer thread."""
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join()
+        self._thread = None
+
+    def submit(self, func, *args, **kwargs):
+        """Queues ``func(cursor, *args, **kwargs)`` and returns a future for its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Queued under the start lock, so a writer that failed to open its
+        # connection either sees this item or a new writer is started for it
+        with self._start_lock:
+            self._start()
+            self._queue.put((func, args, kwargs, loop, future))
+        return future
+
+    def _run(self):
+        try:
+            conn = self.database._create_connection()
+        except Exception as e:
+            logger.exception("Opening the writer connection failed")
+            self._fail_queued(e)
+            return
+        # Transactions are managed explicitly so a whole batch shares one
+        conn.isolation_level = None
+        stopping = False
+        try:
+            while not stopping:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+
+                batch = [item]
+                deadline = time.monotonic() + self.batch_window
+                while len(batch) < self.max_batch:
+                    timeout = deadline - time.monotonic()
+                    try:
+                        item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+
+                self._commit_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn, batch):
+        results = []
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for func, args, kwargs, loop, future in batch:
+                cursor.execute('SAVEPOINT write_op')
+                try:
+                    result = func(cursor, *args, **kwargs)
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO write_op')
+                    cursor.execute('RELEASE write_op')
+                    results.append((loop, future, None, e))
+                else:
+                    cursor.execute('RELEASE write_op')
+                    results.append((loop, future, result, None))
+            cursor.execute('COMMIT')
+        except Exception as e:
+            logger.exception("Write batch of %d operations failed", len(batch))
+            if conn.in_transaction:
+                conn.rollback()
+            results = [(loop, future, None, e) for _, _, _, loop, future in batch]
+
+        for loop, future, result, error in results:
+            try:
+                loop.call_soon_threadsafe(_resolve, future, result, error)
+            except RuntimeError:
+                # Event loop already closed, nobody is waiting anymore
+                pass
+
+    def _fail_queued(self, error):
+        """Fails everything queued; the next submit starts a fresh writer."""
+        with self._start_lock:
+            self._thread = None
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    continue
+                _, _, _, loop, future = item
+                try:
+                    loop.call_soon_threadsafe(_resolve, future, None, error)
+                except RuntimeError:
+                    pass
+
+
+def _resolve(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)